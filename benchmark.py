@@ -0,0 +1,454 @@
+"""
+Замер скорости этапов обработки выгрузок со связями
+
+Запуск:
+    python benchmark.py split --records 100000 1000000 3000000
+    python benchmark.py pipeline --rows 1000 10000 100000 --output bench.json
+    python benchmark.py dedup --links 1000000 5000000
+    python benchmark.py engine --records 100000 1000000
+    python benchmark.py startup --rows 1000 100000
+    python benchmark.py detail --links 1000000 --years 3
+
+split    - сравнение split_df с прежней реализацией на данных в памяти
+pipeline - замер этапов от чтения файла до записи отчета на синтетических выгрузках
+           из локальной папки (SOURCE['TYPE'] = 'local'). Результат в JSON для сравнения между коммитами
+dedup    - построение индекса отпечатков связей, скорость проверки и память на 1 млн связей
+engine   - сравнение движков разбора записей pandas и polars (TRANSFORM['ENGINE']) и проверка,
+           что результат и файл карантина у них совпадают
+startup  - холодный запуск: импорт main и python main.py --check в отдельном процессе,
+           поиск строки заголовка в выгрузке по сравнению с прежней проверкой всей таблицы
+detail   - выборка связей одного сотрудника из хранилища за месяц и за год по индексу
+           links_employee_date и размер хранилища
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import types
+from datetime import datetime
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+
+try:
+    import config
+except ImportError:
+    # Для замеров рабочий config.py не нужен, все параметры задаются ниже
+    config = types.ModuleType('config')
+    config.EMAIL_CONFIG = {'FROM': '', 'PSW': ''}
+    sys.modules['config'] = config
+
+import dedup_index
+import link_store
+import main
+import synthetic_exports
+
+
+def make_info_frame(records, per_cell=5, employees=50, seed=0):
+    """
+    Создаём DataFrame как после rebuild_df: индекс "Код" и колонка "Дополнительная информация"
+    :param records: int - Общее количество записей о связях
+    :param per_cell: int - Среднее количество записей в одной ячейке
+    :param employees: int - Количество сотрудников
+    :param seed: int - Начальное значение генератора случайных чисел
+    :return: DataFrame
+    """
+    rng = np.random.default_rng(seed)
+    entries = synthetic_exports.make_records(records, employees=employees, seed=seed)
+
+    # Распределяем записи по ячейкам случайной длины
+    cells = max(records // per_cell, 1)
+    cell_id = np.sort(rng.integers(0, cells, records))
+    info = entries.groupby(cell_id).agg(';'.join)
+    return pd.DataFrame({'Дополнительная информация': info.values},
+                        index=pd.Index([f"K{i}" for i in info.index], name='Код'))
+
+
+def split_df_legacy(df):
+    """
+    Прежняя реализация разбиения через широкий DataFrame и пошаговый pd.concat, для сравнения.
+    Построчная проверка дат find_problematic_rows сюда не входит
+    """
+    df_temp1 = df['Дополнительная информация'].str.split(';', expand=True)
+    df_temp = pd.DataFrame()
+    for i in df_temp1.columns:
+        df_temp2 = df_temp1[[i]].dropna(how='all', axis=0).copy()
+        df_temp2.columns = [0]
+        df_temp = pd.concat([df_temp, df_temp2])
+    df_result = df_temp[0].str.split('/', expand=True)
+    df_result[0] = pd.to_datetime(df_result[0], format="%d.%m.%Y %H:%M:%S").dt.floor('D')
+    df_result = df_result.drop_duplicates(subset=[0, 1, 4])
+    df_result.columns = ['Дата', 'ИК сотрудника', 'Код источник', 'Код добавленный', 'Номер группы']
+    return df_result
+
+
+def timed(func, *args):
+    """
+    Выполняем функцию и замеряем время
+    :return: tuple - (результат, секунды)
+    """
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def bench_split(records, per_cell):
+    """Сравниваем split_df с прежней реализацией на одном объёме данных"""
+    df = make_info_frame(records, per_cell)
+    legacy, legacy_sec = timed(split_df_legacy, df)
+    result, sec = timed(main.split_df, df)
+    df_records, _ = timed(main.split_records, df['Дополнительная информация'])
+    _, validate_sec = timed(main.validate_records, df_records)
+    return {
+        'stage': 'split_df',
+        'records': records,
+        'per_cell': per_cell,
+        'legacy_sec': round(legacy_sec, 3),
+        'sec': round(sec, 3),
+        'speedup': round(legacy_sec / sec, 2),
+        'validate_sec': round(validate_sec, 3),
+        'validate_share': round(validate_sec / sec, 3),
+        'same_result': bool(legacy.equals(result)),
+    }
+
+
+def bench_engine(records, per_cell, work_dir):
+    """Сравниваем движки разбора записей на одном объёме данных, часть записей ошибочная"""
+    df = make_info_frame(records, per_cell)
+    df.iloc[::1000, 0] = df.iloc[::1000, 0] + ';01.02.2026 25:00:00/E1/A/B/1;01.02.2026 10:00:00/E1/A'
+    result = {'stage': 'split_df_engine', 'records': records, 'per_cell': per_cell}
+    outputs = {}
+    for engine in ('pandas', 'polars'):
+        quarantine = os.path.join(work_dir, engine)
+        with mock.patch.object(config, 'TRANSFORM', {'ENGINE': engine}, create=True), \
+                mock.patch.object(config, 'QUARANTINE', {'PATH': quarantine}, create=True):
+            if main.transform_engine() != engine:
+                result[f'{engine}_sec'] = None
+                continue
+            df_result, result[f'{engine}_sec'] = timed(main.split_df, df, 'bench.xlsx')
+        with open(os.path.join(quarantine, 'bench.csv'), encoding='utf-8-sig') as fd:
+            outputs[engine] = df_result, fd.read()
+
+    if len(outputs) == 2:
+        (df_pandas, quarantine_pandas), (df_polars, quarantine_polars) = outputs['pandas'], outputs['polars']
+        result['speedup'] = round(result['pandas_sec'] / result['polars_sec'], 2)
+        result['same_result'] = bool(df_pandas.equals(df_polars) and df_pandas.index.equals(df_polars.index)
+                                     and (df_pandas.dtypes == df_polars.dtypes).all())
+        result['same_quarantine'] = quarantine_pandas == quarantine_polars
+    for engine in outputs:
+        result[f'{engine}_sec'] = round(result[f'{engine}_sec'], 3)
+    return result
+
+
+def bench_dedup(links, employees=50, seed=0):
+    """Замеряем индекс отпечатков: построение, проверку половины новых связей и размер"""
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({
+        'Дата': pd.Timestamp('2026-01-01') + pd.to_timedelta(rng.integers(0, 365, links), unit='D'),
+        'ИК сотрудника': pd.Categorical(rng.integers(0, employees, links).astype(str)),
+        'Номер группы': np.arange(links, dtype=np.int64),
+        'Тип связи': main.link_type_column('А', links),
+    })
+    values, fingerprint_sec = timed(dedup_index.fingerprints, df)
+    index, build_sec = timed(dedup_index.FingerprintIndex, values)
+    # Половина проверяемых связей уже есть в индексе
+    probe = np.concatenate([values[:links // 2], values[:links // 2] + np.uint64(1)])
+    _, lookup_sec = timed(index.new_mask, probe)
+    with tempfile.TemporaryDirectory() as work_dir:
+        path = os.path.join(work_dir, 'links.fingerprints.npz')
+        index.save(path, links)
+        file_bytes = os.path.getsize(path)
+    memory = index.index.memory_usage(deep=True)
+    return {
+        'stage': 'dedup_index',
+        'links': links,
+        'fingerprint_sec': round(fingerprint_sec, 3),
+        'build_sec': round(build_sec, 3),
+        'lookups_per_sec': round(len(probe) / lookup_sec),
+        'collisions': links - len(index),
+        'bytes_per_million': round(memory * 1_000_000 / links),
+        'file_bytes_per_million': round(file_bytes * 1_000_000 / links),
+    }
+
+
+@contextlib.contextmanager
+def local_share(path, work_dir):
+    """
+    Берём выгрузки из локальной папки вместо сетевой: источник SOURCE['TYPE'] = 'local'
+
+    :param path: str - Локальная папка с выгрузками
+    :param work_dir: str - Папка для файлов отчета, кэша и карантина
+    """
+    settings = {
+        'SOURCE': {'TYPE': 'local', 'PATH': path},
+        'TO_EMAILS': {'TO_CORRECT': []},
+        'CACHE': {'ENABLED': False},
+        'STORE': {'ENABLED': False},
+        'PARALLEL': {'WORKERS': 1},
+        'QUARANTINE': {'PATH': os.path.join(work_dir, 'quarantine')},
+    }
+    cwd = os.getcwd()
+    with contextlib.ExitStack() as stack:
+        for name, value in settings.items():
+            stack.enter_context(mock.patch.object(config, name, value, create=True))
+        os.chdir(work_dir)
+        try:
+            yield
+        finally:
+            os.chdir(cwd)
+
+
+def bench_pipeline(rows, work_dir, year):
+    """
+    Замеряем этапы обработки на синтетических выгрузках одного размера
+
+    :param rows: int - Количество строк в каждой выгрузке
+    :param work_dir: str - Временная папка
+    :param year: int - Год данных и отчета
+    :return: list - Результаты по этапам
+    """
+    share = os.path.join(work_dir, f'share_{rows}')
+    records = synthetic_exports.generate_share(share, rows, start=f'{year}-01-01')
+    date = datetime(year, 12, 5)  # Декабрь: строятся все листы, включая годовой
+
+    stages = {}
+
+    def add(stage, sec, count):
+        total = stages.setdefault(stage, {'sec': 0.0, 'rows': 0})
+        total['sec'] += sec
+        total['rows'] += count
+
+    with local_share(share, work_dir), mock.patch.object(main, 'date_report', return_value=date):
+        dict_df = {}
+        raw_bytes = 0
+        for item in sorted(os.listdir(share)):
+            df, sec = timed(main.read_report, item)
+            add('read_report', sec, len(df))
+            df, sec = timed(main.rebuild_df, df)
+            add('rebuild_df', sec, len(df))
+            df, sec = timed(main.split_df, df)
+            add('split_df', sec, len(df))
+            df, sec = timed(main.filter_df_by_date, df, date, False, True)
+            add('filter_df_by_date', sec, len(df))
+            raw_bytes += main.bytes_per_million(df) * len(df)
+            df, sec = timed(main.compact_records, df, main.link_type(item))
+            add('compact_records', sec, len(df))
+            dict_df[main.link_type(item)] = df
+        dict_df['T'], sec = timed(main.concat_records, list(dict_df.values()))
+        add('concat_records', sec, len(dict_df['T']))
+        memory = {'raw_bytes_per_million': int(raw_bytes / max(len(dict_df['T']), 1)),
+                  'bytes_per_million': main.bytes_per_million(dict_df['T'])}
+
+        rollup, sec = timed(main.rollup_records, dict_df)
+        add('rollup_records', sec, len(rollup['T']))
+
+        with pd.ExcelWriter(os.path.join(work_dir, 'months.xlsx'), engine='xlsxwriter') as writer:
+            _, sec = timed(main.months_reports, writer, writer.book, rollup)
+        add('months_reports', sec, len(rollup['T']))
+
+        _, sec = timed(main.report_to_excel, dict_df)
+        add('report_to_excel', sec, len(dict_df['T']))
+
+    results = [
+        {'rows': rows, 'records': sum(records.values()), 'stage': stage,
+         'sec': round(value['sec'], 3), 'out_rows': value['rows']}
+        for stage, value in stages.items()
+    ]
+    # Память под записи до и после перевода в компактный вид
+    results.append({'rows': rows, 'records': sum(records.values()), 'stage': 'records_memory', **memory})
+    return results
+
+
+def bench_detail(links, years, work_dir, employees=50, seed=0):
+    """
+    Замеряем выборку связей одного сотрудника из хранилища с историей за несколько лет
+
+    :param links: int - Количество связей в хранилище
+    :param years: int - Количество лет истории
+    :param work_dir: str - Временная папка
+    :return: dict
+    """
+    rng = np.random.default_rng(seed)
+    start = datetime(datetime.today().year - years + 1, 1, 1)
+    df = pd.DataFrame({
+        'Код': [f'ЦБ{code:08d}' for code in rng.integers(0, 10 ** 6, links)],
+        'Дата': pd.Timestamp(start) + pd.to_timedelta(rng.integers(0, 365 * years, links), unit='D'),
+        'ИК сотрудника': rng.integers(0, employees, links).astype(str),
+        'Код источник': [f'ЦБ{code:08d}' for code in rng.integers(0, 10 ** 6, links)],
+        'Код добавленный': [f'ЦБ{code:08d}' for code in rng.integers(0, 10 ** 6, links)],
+        'Номер группы': np.arange(links).astype(str),
+    }).set_index('Код')
+    path = os.path.join(work_dir, f'detail_{links}.sqlite')
+    with mock.patch.object(config, 'STORE', {'ENABLED': True, 'PATH': path}, create=True):
+        conn = link_store.connect()
+    with conn:
+        _, insert_sec = timed(link_store.replace_since, conn, 'А', df)
+    conn.execute("VACUUM")
+
+    last = start.replace(year=start.year + years - 1)
+    result = {'links': links, 'years': years, 'insert_sec': round(insert_sec, 3),
+              'store_bytes_per_million': round(os.path.getsize(path) * 1_000_000 / links)}
+    for name, date_range in {'month': (last, last.replace(month=2)),
+                             'year': (last, last.replace(year=last.year + 1))}.items():
+        times = []
+        for employee in range(10):
+            found, sec = timed(link_store.load_employee, conn, str(employee), *date_range)
+            times.append(sec)
+        result[f'{name}_rows'] = len(found)
+        result[f'{name}_ms'] = round(min(times) * 1000, 2)
+    plan = conn.execute("EXPLAIN QUERY PLAN SELECT * FROM links INDEXED BY links_employee_date "
+                        "WHERE employee = '0' AND date >= '2026-01-01'").fetchall()
+    result['covering_index'] = any('COVERING INDEX links_employee_date' in row[-1] for row in plan)
+    conn.close()
+    return result
+
+
+def header_legacy(df):
+    """Прежний поиск строки заголовка: сравнение всей таблицы со словом Код"""
+    mask_start = df == 'Код'
+    return mask_start.any(axis=1).idxmax()
+
+
+def bench_startup(rows, work_dir, repeats=3):
+    """
+    Замеряем холодный запуск в отдельном процессе и поиск строки заголовка в выгрузке
+
+    :param rows: int - Количество строк в выгрузке для поиска заголовка
+    :param work_dir: str - Временная папка
+    :param repeats: int - Количество повторов, берётся лучшее время
+    :return: dict
+    """
+    share = os.path.join(work_dir, f'startup_{rows}')
+    synthetic_exports.generate_share(share, 10)
+    root = os.path.dirname(os.path.abspath(__file__))
+    # Рабочий config.py не нужен: в отдельном процессе подставляем тот же модуль, что и в local_share
+    prelude = (
+        "import sys, types; config = types.ModuleType('config'); "
+        "config.EMAIL_CONFIG = {'FROM': '', 'PSW': ''}; "
+        f"config.SOURCE = {{'TYPE': 'local', 'PATH': {share!r}}}; "
+        "config.CACHE = {'ENABLED': True}; config.STORE = {'ENABLED': False}; "
+        "sys.modules['config'] = config; "
+    )
+    commands = {
+        'import_main_sec': prelude + "import main",
+        'import_main_pandas_sec': prelude + "import main; main.pd.DataFrame",
+        'check_sec': prelude + "import main; main.check_reports()",
+    }
+    env = {**os.environ, 'PYTHONPATH': root}
+    result = {'rows': rows}
+    for key, code in commands.items():
+        times = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            subprocess.run([sys.executable, '-c', code], cwd=work_dir, env=env, check=True, capture_output=True)
+            times.append(time.perf_counter() - start)
+        result[key] = round(min(times), 3)
+
+    # Шапка и строка заголовка как в выгрузке, остальные колонки заполнены
+    file_name = os.path.join(work_dir, f'header_{rows}.xlsx')
+    synthetic_exports.write_export(file_name, rows)
+    df = pd.read_excel(file_name, header=None)
+    row, sec_new = timed(main.find_header_row, df)
+    legacy, sec_old = timed(header_legacy, df)
+    assert row == legacy
+    result.update({'header_row': int(row), 'header_sec': round(sec_new, 5), 'legacy_header_sec': round(sec_old, 5)})
+    return result
+
+
+def environment():
+    """Сведения о версии кода и окружении для сравнения результатов"""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = ''
+    return {
+        'commit': commit,
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+    }
+
+
+def run():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    parser_split = subparsers.add_parser('split', help='Сравнение split_df с прежней реализацией')
+    parser_split.add_argument('--records', type=int, nargs='+', default=[100_000, 1_000_000],
+                              help='Количество записей о связях для замера')
+    parser_split.add_argument('--per-cell', type=int, default=5, help='Среднее количество записей в одной ячейке')
+
+    parser_pipeline = subparsers.add_parser('pipeline', help='Замер этапов на синтетических выгрузках')
+    parser_pipeline.add_argument('--rows', type=int, nargs='+', default=[1000, 10000],
+                                 help='Количество строк в каждой выгрузке')
+    parser_pipeline.add_argument('--year', type=int, default=datetime.today().year, help='Год данных')
+    parser_pipeline.add_argument('--output', help='Файл для результатов в JSON')
+
+    parser_engine = subparsers.add_parser('engine', help='Сравнение движков разбора записей pandas и polars')
+    parser_engine.add_argument('--records', type=int, nargs='+', default=[100_000, 1_000_000],
+                               help='Количество записей о связях для замера')
+    parser_engine.add_argument('--per-cell', type=int, default=5, help='Среднее количество записей в одной ячейке')
+
+    parser_dedup = subparsers.add_parser('dedup', help='Замер индекса отпечатков связей')
+    parser_dedup.add_argument('--links', type=int, nargs='+', default=[1_000_000],
+                              help='Количество связей в индексе')
+    parser_startup = subparsers.add_parser('startup', help='Замер холодного запуска и поиска строки заголовка')
+    parser_startup.add_argument('--rows', type=int, nargs='+', default=[1000, 100_000],
+                                help='Количество строк в выгрузке для поиска заголовка')
+    parser_detail = subparsers.add_parser('detail', help='Замер выборки связей сотрудника из хранилища')
+    parser_detail.add_argument('--links', type=int, nargs='+', default=[1_000_000],
+                               help='Количество связей в хранилище')
+    parser_detail.add_argument('--years', type=int, default=3, help='Количество лет истории')
+    args = parser.parse_args()
+
+    if args.command == 'detail':
+        with tempfile.TemporaryDirectory() as work_dir:
+            for links in args.links:
+                print(json.dumps(bench_detail(links, args.years, work_dir), ensure_ascii=False))
+        return
+
+    if args.command == 'startup':
+        with tempfile.TemporaryDirectory() as work_dir:
+            for rows in args.rows:
+                print(json.dumps(bench_startup(rows, work_dir), ensure_ascii=False))
+        return
+
+    if args.command == 'engine':
+        with tempfile.TemporaryDirectory() as work_dir:
+            for records in args.records:
+                print(json.dumps(bench_engine(records, args.per_cell, work_dir), ensure_ascii=False))
+        return
+
+    if args.command == 'dedup':
+        for links in args.links:
+            print(json.dumps(bench_dedup(links), ensure_ascii=False))
+        return
+
+    if args.command == 'split':
+        for records in args.records:
+            print(json.dumps(bench_split(records, args.per_cell), ensure_ascii=False))
+        return
+
+    results = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        for rows in args.rows:
+            for result in bench_pipeline(rows, work_dir, args.year):
+                print(json.dumps(result, ensure_ascii=False))
+                results.append(result)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as fd:
+            json.dump({**environment(), 'results': results}, fd, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,112 @@
+"""
+Индекс отпечатков связей для удаления повторов между файлами выгрузок и между запусками
+
+Отпечаток связи - 64-битный хэш от типа связи, даты, ИК сотрудника и номера группы,
+то есть от ключа удаления дубликатов split_df вместе с типом связи.
+
+На диске индекс хранится отсортированным массивом uint64 (.npz): 8 байт на связь.
+В памяти отпечатки хранятся в pandas.Index, проверка идёт по его хэш-таблице за O(1)
+на отпечаток. Вместе с хэш-таблицей это около 40 байт на связь, 40 МБ на 1 млн связей
+(замер: python benchmark.py dedup).
+
+Настройки задаются в config.py в разделе DEDUP:
+DEDUP = {
+    'ENABLED': True,  # Удалять повторы связей между файлами и, при включённом хранилище, между запусками
+    'PATH': 'links.fingerprints.npz',  # Файл индекса для хранилища связей
+}
+"""
+import os
+
+from lazy_import import lazy_import
+from settings import get_option
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+
+
+def is_enabled():
+    """Проверяем, включено ли удаление повторов между файлами"""
+    return get_option('DEDUP', 'ENABLED', True)
+
+
+def index_path():
+    return get_option('DEDUP', 'PATH', 'links.fingerprints.npz')
+
+
+def fingerprints(df, link_type=None):
+    """
+    Считаем отпечатки связей
+
+    :param df: DataFrame с колонками 'Дата', 'ИК сотрудника', 'Номер группы' и 'Тип связи'
+    :param link_type: str - Тип связи, если в df нет колонки 'Тип связи'
+    :return: numpy массив uint64
+    """
+    if link_type is None:
+        types = df['Тип связи'].astype(str).to_numpy()
+    else:
+        types = np.full(len(df), link_type, dtype=object)
+    key = pd.DataFrame({
+        'type': types,
+        'date': df['Дата'].to_numpy().astype('datetime64[D]').astype(np.int64),
+        'employee': df['ИК сотрудника'].astype(str).to_numpy(),
+        'group': df['Номер группы'].astype(str).to_numpy(),
+    })
+    return pd.util.hash_pandas_object(key, index=False).to_numpy()
+
+
+class FingerprintIndex:
+    """Множество отпечатков связей с проверкой по хэш-таблице"""
+
+    def __init__(self, values=(), links=None):
+        """
+        :param values: Отпечатки связей
+        :param links: int - Количество связей в хранилище на момент сохранения индекса
+        """
+        self.index = pd.Index(np.unique(np.asarray(values, dtype=np.uint64)))
+        self.links = links
+
+    def __len__(self):
+        return len(self.index)
+
+    def contains(self, values):
+        """
+        :param values: numpy массив отпечатков
+        :return: numpy массив bool - отпечаток уже есть в индексе
+        """
+        return self.index.get_indexer(values) >= 0
+
+    def new_mask(self, values):
+        """
+        Отмечаем отпечатки, которых нет в индексе, каждый только при первом вхождении
+        :return: numpy массив bool
+        """
+        return ~self.contains(values) & ~pd.Index(values).duplicated()
+
+    def add(self, values):
+        self.index = pd.Index(np.union1d(self.index.to_numpy(), values))
+
+    def remove(self, values):
+        self.index = self.index[~self.index.isin(values)]
+
+    def save(self, path, links):
+        """
+        Сохраняем индекс, файл заменяется целиком
+        :param path: str - Файл индекса
+        :param links: int - Количество связей в хранилище, по нему проверяется, что индекс не устарел
+        """
+        with open(path + '.tmp', 'wb') as fd:
+            np.savez(fd, fingerprints=self.index.to_numpy(), links=np.int64(links))
+        os.replace(path + '.tmp', path)
+        self.links = links
+
+    @classmethod
+    def load(cls, path):
+        """
+        Считываем индекс из файла
+        :return: FingerprintIndex или None, если файла нет
+        """
+        try:
+            with np.load(path) as data:
+                return cls(data['fingerprints'], int(data['links']))
+        except (OSError, ValueError, KeyError):
+            return None
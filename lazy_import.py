@@ -0,0 +1,38 @@
+"""
+Отложенный импорт тяжёлых модулей
+
+Модуль из lazy_import загружается при первом обращении к его атрибуту. Запуски, которым
+модуль не нужен (например, python main.py --check), не тратят время на его импорт.
+"""
+import importlib.util
+import sys
+
+
+def lazy_import(name):
+    """
+    Получаем модуль, который загрузится при первом обращении к нему
+
+    :param name: str - Имя модуля верхнего уровня, например 'pandas'
+    :return: Модуль или None, если модуль не установлен
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        return None
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+
+def load(*modules):
+    """
+    Загружаем отложенные модули сразу. Вызывается перед запуском потоков:
+    до Python 3.12 первая загрузка отложенного модуля из нескольких потоков одновременно не безопасна
+    """
+    for module in modules:
+        if module is not None:
+            getattr(module, '__name__')
@@ -0,0 +1,114 @@
+"""
+Связи сотрудника за период из хранилища связей
+
+Расшифровка количества связей сотрудника в отчете: какие именно связи он создал.
+Связи берутся из хранилища (раздел STORE в config.py), выгрузки заново не считываются.
+
+Запуск:
+    python link_detail.py 000123 --period 2026-03-01:2026-03-31              - вывести связи в журнал
+    python link_detail.py 000123 000456 --period 2026 --output detail.xlsx  - лист на каждого сотрудника
+    python link_detail.py 000123 --period 2026-H1 --output detail.csv       - все связи одной таблицей
+"""
+import argparse
+import os
+
+from loguru import logger
+
+import link_store
+import main
+import metrics
+import report_periods
+from lazy_import import lazy_import
+
+pd = lazy_import('pandas')
+
+
+def employee_links(employees, periods=None):
+    """
+    Считываем связи сотрудников за период отчетов
+
+    :param employees: list - ИК сотрудников
+    :param periods: list - ReportPeriod. None - ежемесячный отчет по дате отчета
+    :return: dict - ИК сотрудника -> DataFrame из link_store.load_employee
+    """
+    date_range = report_periods.periods_range(periods or [main.report_period()])
+    conn = link_store.connect()
+    try:
+        result = {}
+        for employee in employees:
+            with metrics.stage('load_employee', employee=employee) as m:
+                result[employee] = link_store.load_employee(conn, employee, *date_range)
+                m['rows'] = len(result[employee])
+    finally:
+        conn.close()
+    return result
+
+
+def write_csv(dict_df, file_name):
+    """Записываем связи всех сотрудников в один CSV, ИК сотрудника - в отдельной колонке"""
+    df = pd.concat(dict_df.values()) if dict_df else pd.DataFrame(columns=['Тип связи'] + list(link_store.COLUMNS))
+    # Разделитель и BOM, с которыми эксель открывает файл без мастера импорта
+    df.to_csv(file_name, sep=';', index=False, encoding='utf-8-sig', date_format='%d.%m.%Y')
+    return [file_name]
+
+
+def write_xlsx(dict_df, file_name):
+    """Записываем связи каждого сотрудника на отдельный лист"""
+    with pd.ExcelWriter(file_name, engine='xlsxwriter', datetime_format='dd.mm.yyyy') as writer:
+        formats = main.report_formats(writer.book)
+        for employee, df in dict_df.items():
+            sheet_name = f'Связи {employee}'[:31]
+            df.to_excel(writer, sheet_name=sheet_name, index=False, startrow=1)
+            wks = writer.sheets[sheet_name]
+            wks.write(0, 0, f'Связи сотрудника {employee}: {len(df)}', formats['header'])
+            wks.set_column(0, 0, 11)
+            wks.set_column(1, len(df.columns) - 1, 16)
+            wks.autofilter(1, 0, len(df) + 1, len(df.columns) - 1)
+            wks.freeze_panes(2, 0)
+    return [file_name]
+
+
+def write_detail(dict_df, file_name):
+    """
+    Сохраняем связи сотрудников в файл, формат по расширению: .csv или .xlsx
+
+    :param dict_df: dict - ИК сотрудника -> DataFrame из employee_links
+    :param file_name: str - Имя файла
+    :return: list -> Имя файла
+    """
+    if os.path.splitext(file_name)[1].lower() == '.csv':
+        return write_csv(dict_df, file_name)
+    return write_xlsx(dict_df, file_name)
+
+
+def log_summary(dict_df):
+    """Выводим в журнал количество связей по месяцам и типам связи, как в отчете, и сами связи"""
+    for employee, df in dict_df.items():
+        summary = df.groupby([df['Дата'].dt.to_period('M'), 'Тип связи']).size().unstack(fill_value=0)
+        logger.info(f"Связи сотрудника {employee}: {len(df)}\n{summary.to_string() if len(df) else ''}")
+        if len(df):
+            logger.info(f"\n{df.to_string(index=False)}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Связи сотрудника за период из хранилища связей',
+                                     epilog=__doc__ + report_periods.__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('employees', nargs='+', help='ИК сотрудников')
+    parser.add_argument('--period', nargs='+', default=[],
+                        help='Период связей, по умолчанию - месяц даты отчета с начала года. Форматы ниже')
+    parser.add_argument('--output', help='Файл .xlsx (лист на каждого сотрудника) или .csv. '
+                                         'По умолчанию связи выводятся в журнал')
+    args = parser.parse_args()
+    try:
+        report_list = report_periods.parse_periods(args.period)
+    except ValueError as error:
+        parser.error(str(error))
+    if not link_store.is_enabled():
+        parser.error("Хранилище связей выключено: связи сотрудников сохраняются только при STORE['ENABLED'] = True")
+
+    links = employee_links(args.employees, report_list)
+    if args.output:
+        logger.info(f"Связи сотрудников записаны в файл: {write_detail(links, args.output)}")
+    else:
+        log_summary(links)
@@ -0,0 +1,252 @@
+"""
+Локальное хранилище разобранных связей
+
+Связи хранятся в SQLite по типам связи. При каждом запуске по каждому типу связи добавляются
+только записи начиная с последней сохранённой даты (водяной знак). Записи за день водяного
+знака заменяются целиком, так как выгрузка за этот день могла пополниться.
+
+Рядом хранится свёртка daily_counts - количество связей по дням, ИК сотрудника и типу связи.
+Она пересчитывается только начиная с водяного знака, закрытые дни не меняются.
+Отчеты строятся по свёртке, а не по отдельным связям.
+
+Для выборки связей одного сотрудника (load_employee, python link_detail.py) связи дополнительно
+хранятся в покрывающем индексе links_employee_date, упорядоченном по ИК сотрудника и дате.
+Связи сотрудника за период лежат в индексе подряд и считываются без обращения к таблице,
+поэтому выборка не просматривает остальные связи. Индекс примерно удваивает размер хранилища.
+
+Настройки задаются в config.py в разделе STORE:
+STORE = {
+    'ENABLED': True,  # Использовать хранилище
+    'PATH': 'links.sqlite',  # Файл хранилища
+}
+"""
+import sqlite3
+
+import dedup_index
+from lazy_import import lazy_import
+from settings import get_option
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+
+COLUMNS = {
+    'Код': 'code',
+    'Дата': 'date',
+    'ИК сотрудника': 'employee',
+    'Код источник': 'source_code',
+    'Код добавленный': 'added_code',
+    'Номер группы': 'group_number',
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS links (
+    link_type TEXT NOT NULL,
+    code TEXT,
+    date TEXT NOT NULL,
+    employee TEXT NOT NULL,
+    source_code TEXT,
+    added_code TEXT,
+    group_number TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS links_type_date ON links (link_type, date);
+CREATE INDEX IF NOT EXISTS links_employee_date
+    ON links (employee, date, link_type, group_number, code, source_code, added_code);
+CREATE TABLE IF NOT EXISTS daily_counts (
+    link_type TEXT NOT NULL,
+    date TEXT NOT NULL,
+    employee TEXT NOT NULL,
+    links INTEGER NOT NULL,
+    PRIMARY KEY (link_type, date, employee)
+);
+"""
+
+
+def is_enabled():
+    """Проверяем, включено ли хранилище"""
+    return get_option('STORE', 'ENABLED', False)
+
+
+def connect():
+    """
+    Открываем хранилище и создаём таблицы при необходимости
+    :return: sqlite3.Connection
+    """
+    conn = sqlite3.connect(get_option('STORE', 'PATH', 'links.sqlite'))
+    conn.executescript(SCHEMA)
+    # Хранилище без свёртки, созданное до её появления: считаем свёртку по всем связям один раз
+    if conn.execute("SELECT NOT EXISTS (SELECT 1 FROM daily_counts) AND EXISTS (SELECT 1 FROM links)").fetchone()[0]:
+        with conn:
+            for link_type in link_types(conn):
+                refresh_counts(conn, link_type)
+    return conn
+
+
+def clear(conn):
+    """Удаляем все связи из хранилища для полной пересборки"""
+    conn.execute("DELETE FROM links")
+    conn.execute("DELETE FROM daily_counts")
+
+
+def watermarks(conn):
+    """
+    Получаем последнюю сохранённую дату по каждому типу связи
+    :return: dict - Тип связи -> Timestamp
+    """
+    rows = conn.execute("SELECT link_type, MAX(date) FROM links GROUP BY link_type").fetchall()
+    return {link_type: pd.Timestamp(date) for link_type, date in rows}
+
+
+def replace_since(conn, link_type, df, since=None, index=None, until=None):
+    """
+    Заменяем связи типа link_type начиная с даты since записями из df.
+    С индексом отпечатков добавляем и связи до since, которых ещё нет в хранилище.
+    Связи с даты until не трогаем: df содержит данные только до неё
+
+    :param conn: sqlite3.Connection
+    :param link_type: str - Тип связи
+    :param df: DataFrame - результат split_df
+    :param since: Timestamp - Водяной знак или None, если связей этого типа ещё нет
+    :param index: FingerprintIndex - Отпечатки всех связей хранилища, обновляется вместе с ним
+    :param until: datetime - Конец периода данных df. None - без ограничения
+    :return: int - Количество добавленных записей
+    """
+    if until is not None:
+        df = df.loc[df['Дата'] < until]
+    refresh_since = since
+    if since is not None:
+        late = df.iloc[:0]
+        if index is not None:
+            # Связи до водяного знака, которых нет в хранилище, например появившиеся в выгрузке задним числом
+            late = df.loc[df['Дата'] < since]
+            late = late.loc[index.new_mask(dedup_index.fingerprints(late, link_type))]
+            if not late.empty:
+                refresh_since = late['Дата'].min()
+            # Связи с водяного знака заменяются целиком, их отпечатки добавятся заново
+            index.remove(dedup_index.fingerprints(load(conn, link_type, since, until), link_type))
+        df = pd.concat([late, df.loc[df['Дата'] >= since]])
+        query = "DELETE FROM links WHERE link_type = ? AND date >= ?"
+        params = [link_type, since.strftime('%Y-%m-%d')]
+        if until is not None:
+            # Водяной знак может быть позже конца периода, например после отчета за прошлый месяц
+            query += " AND date < ?"
+            params.append(until.strftime('%Y-%m-%d'))
+        conn.execute(query, params)
+    if index is not None:
+        index.add(dedup_index.fingerprints(df, link_type))
+
+    df = df.reset_index()
+    records = zip(
+        [link_type] * len(df),
+        df['Код'].astype(str).tolist() if 'Код' in df else [None] * len(df),
+        df['Дата'].dt.strftime('%Y-%m-%d').tolist(),
+        df['ИК сотрудника'].tolist(),
+        df['Код источник'].tolist(),
+        df['Код добавленный'].tolist(),
+        df['Номер группы'].tolist(),
+    )
+    conn.executemany("INSERT INTO links VALUES (?, ?, ?, ?, ?, ?, ?)", records)
+    refresh_counts(conn, link_type, refresh_since)
+    return len(df)
+
+
+def refresh_counts(conn, link_type, since=None):
+    """
+    Пересчитываем свёртку по дням для связей типа link_type начиная с даты since
+
+    :param conn: sqlite3.Connection
+    :param link_type: str - Тип связи
+    :param since: Timestamp - Дата начала пересчёта или None - пересчитать полностью
+    """
+    date = '' if since is None else since.strftime('%Y-%m-%d')
+    conn.execute("DELETE FROM daily_counts WHERE link_type = ? AND date >= ?", (link_type, date))
+    conn.execute(
+        "INSERT INTO daily_counts SELECT link_type, date, employee, COUNT(*) FROM links "
+        "WHERE link_type = ? AND date >= ? GROUP BY link_type, date, employee", (link_type, date))
+
+
+def count_links(conn):
+    """Количество связей в хранилище"""
+    return conn.execute("SELECT COUNT(*) FROM links").fetchone()[0]
+
+
+def fingerprint_index(conn, path):
+    """
+    Получаем индекс отпечатков всех связей хранилища. Если файла индекса нет
+    или он сохранён для другого количества связей, строим индекс по хранилищу заново
+
+    :param conn: sqlite3.Connection
+    :param path: str - Файл индекса
+    :return: FingerprintIndex
+    """
+    index = dedup_index.FingerprintIndex.load(path)
+    links = count_links(conn)
+    if index is None or index.links != links:
+        values = [dedup_index.fingerprints(load(conn, link_type), link_type) for link_type in link_types(conn)]
+        index = dedup_index.FingerprintIndex(np.concatenate(values) if values else [], links)
+    return index
+
+
+def link_types(conn):
+    """Получаем типы связей, которые есть в хранилище"""
+    return [row[0] for row in conn.execute("SELECT DISTINCT link_type FROM links ORDER BY link_type")]
+
+
+def load(conn, link_type, date_start=None, date_end=None):
+    """
+    Считываем связи типа link_type за период [date_start, date_end).
+    Не заданная граница периода не ограничивает
+
+    :return: DataFrame с колонками как у split_df и индексом "Код"
+    """
+    query = "SELECT code, date, employee, source_code, added_code, group_number FROM links WHERE link_type = ?"
+    params = [link_type]
+    if date_start is not None:
+        query += " AND date >= ?"
+        params.append(date_start.strftime('%Y-%m-%d'))
+    if date_end is not None:
+        query += " AND date < ?"
+        params.append(date_end.strftime('%Y-%m-%d'))
+    df = pd.read_sql_query(query, conn, params=params)
+    df.columns = list(COLUMNS)
+    df['Дата'] = pd.to_datetime(df['Дата'], format='%Y-%m-%d')
+    return df.set_index('Код')
+
+
+def load_employee(conn, employee, date_start=None, date_end=None):
+    """
+    Считываем связи сотрудника за период [date_start, date_end) по индексу links_employee_date.
+    Не заданная граница периода не ограничивает
+
+    :param conn: sqlite3.Connection
+    :param employee: str - ИК сотрудника
+    :return: DataFrame с колонкой 'Тип связи' и колонками как у split_df, упорядоченный по дате
+    """
+    query = ("SELECT link_type, code, date, employee, source_code, added_code, group_number "
+             "FROM links INDEXED BY links_employee_date WHERE employee = ?")
+    params = [employee]
+    if date_start is not None:
+        query += " AND date >= ?"
+        params.append(date_start.strftime('%Y-%m-%d'))
+    if date_end is not None:
+        query += " AND date < ?"
+        params.append(date_end.strftime('%Y-%m-%d'))
+    query += " ORDER BY employee, date, link_type, group_number"
+    df = pd.read_sql_query(query, conn, params=params)
+    df.columns = ['Тип связи'] + list(COLUMNS)
+    df['Дата'] = pd.to_datetime(df['Дата'], format='%Y-%m-%d')
+    return df
+
+
+def load_counts(conn, link_type, date_start, date_end):
+    """
+    Считываем свёртку по дням для связей типа link_type за период [date_start, date_end)
+
+    :return: DataFrame с колонками 'Дата', 'ИК сотрудника', 'Связей'
+    """
+    df = pd.read_sql_query(
+        "SELECT date, employee, links FROM daily_counts WHERE link_type = ? AND date >= ? AND date < ? "
+        "ORDER BY date, employee",
+        conn, params=(link_type, date_start.strftime('%Y-%m-%d'), date_end.strftime('%Y-%m-%d')))
+    df.columns = ['Дата', 'ИК сотрудника', 'Связей']
+    df['Дата'] = pd.to_datetime(df['Дата'], format='%Y-%m-%d')
+    return df
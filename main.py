@@ -1,12 +1,34 @@
 # Author Loik Andrey 7034@balancedv.ru
+import argparse
 import config
-import pandas as pd
-import smbclient
+import csv
+import dedup_index
+import io
+import itertools
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
 from loguru import logger
+import lazy_import
+import link_store
+import metrics
+import report_cache
+import report_periods
+import report_source
 import send_mail
+from settings import get_option
+from sheet_buffer import SheetBuffer
+from xlsx_stream import XlsxSheet
 from datetime import datetime, timedelta
 from dateutil.relativedelta import relativedelta
 
+# Тяжёлые модули загружаются при первом обращении, например python main.py --check их не загружает.
+# Движок polars необязателен, без него pl = None и записи разбираются в pandas
+np = lazy_import.lazy_import('numpy')
+pd = lazy_import.lazy_import('pandas')
+pl = lazy_import.lazy_import('polars')
+
 """
 Заготовка для записи логов в файл
 logger.add(config.FILE_NAME_CONFIG,
@@ -16,20 +38,126 @@ logger.add(config.FILE_NAME_CONFIG,
            compression="zip")
 """
 
-
-def read_report(path_file):
+# Количество полей в записи колонки "Дополнительная информация": дата/ИК/источник/добавленный/группа
+RECORD_FIELDS = 5
+# Позиции цифр и разделителей в дате записи формата "%d.%m.%Y %H:%M:%S"
+DATE_LENGTH = 19
+DATE_DIGITS = [0, 1, 3, 4, 6, 7, 8, 9, 11, 12, 14, 15, 17, 18]
+DATE_SEPARATORS = {2: '.', 5: '.', 10: ' ', 13: ':', 16: ':'}
+# Годы, даты которых помещаются в pandas.Timestamp
+DATE_YEARS = (1678, 2261)
+DAYS_IN_MONTH = [0, 31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31]
+# Типы связи: 'А' - аналоги, 'Н' - новый номер, 'М' - остальные связи
+LINK_TYPES = ['А', 'Н', 'М']
+# Колонки записи, которые нужны для отчетов. Коды товаров оставляем только по RECORDS['KEEP_CODES']
+REPORT_COLUMNS = ['Дата', 'ИК сотрудника', 'Номер группы', 'Тип связи']
+CODE_COLUMNS = ['Код источник', 'Код добавленный']
+# Периоды отчета. Порядок категорий задаёт порядок листов и колонок
+MONTHS = ['Январь', 'Февраль', 'Март', 'Апрель', 'Май', 'Июнь',
+          'Июль', 'Август', 'Сентябрь', 'Октябрь', 'Ноябрь', 'Декабрь']
+MONTH_NAMES = ['не определено'] + MONTHS
+HALF_YEARS = ['I Полугодие', 'II Полугодие']
+QUARTERS = ['I Квартал', 'II Квартал', 'III Квартал', 'IV Квартал']
+
+
+def read_report(item):
     """
     Считываем файл в DataFrame
-    :param path_file: -> str - Путь к файлу
+    :param item: -> str - Имя файла в источнике выгрузок
     :return: DataFrame с данными из файла
     """
     try:
-        with smbclient.open_file(path_file, mode="rb") as fd:
-            file_bytes = fd.read()
-            return pd.read_excel(file_bytes)
+        return pd.read_excel(io.BytesIO(read_report_bytes(item)))
+    except ConnectionError:
+        logger.error(f"Не могу подключиться к папке с отчетами:")
+        logger.error(ConnectionError)
+
+
+def read_report_bytes(item, stat=None):
+    """
+    Считываем содержимое файла из источника выгрузок
+    :param item: -> str - Имя файла
+    :param stat: Сведения о файле, если уже получены
+    :return: bytes - Содержимое файла
+    """
+    return report_source.get_source().read(item, stat)
+
+
+def parse_report(file_bytes, source=''):
+    """
+    Разбираем выгрузку со связями
+    :param file_bytes: bytes - Содержимое файла выгрузки
+    :param source: str - Имя файла выгрузки
+    :return: DataFrame с колонками из колонки "Дополнительная информация"
+    """
+    with metrics.stage('parse_excel', file=source, input_bytes=len(file_bytes)) as m:
+        if get_option('READER', 'ENGINE', 'pandas') == 'stream':
+            df = read_report_columns(io.BytesIO(file_bytes))
+        else:
+            df = pd.read_excel(io.BytesIO(file_bytes))
+            df = rebuild_df(df)  # Очищаем DataFrame
+        m['rows'] = len(df)
+
+    with metrics.stage('split_df', file=source) as m:
+        df = split_df(df, source)  # Разделяем по колонкам
+        m['rows'] = len(df)
+    return df
+
+
+def fetch_report(item):
+    """
+    Сетевая часть обработки файла: получаем сведения о файле и, если разобранных данных нет в кэше,
+    скачиваем файл. Выполняется в фоновых потоках, пока разбирается предыдущий файл
+
+    :param item: -> str - Имя файла
+    :return: tuple - (сведения о файле, DataFrame из кэша или None, содержимое файла или None)
+             или None, если не удалось подключиться к папке с отчетами
+    """
+    source = report_source.get_source()
+    try:
+        with metrics.stage('source_stat', file=item):
+            stat = source.stat(item)
+        df = report_cache.lookup(source.location(item), stat.st_size, stat.st_mtime)
+        if df is not None:
+            logger.info("Файл не изменился, берём разобранные данные из кэша")
+            return stat, df, None
+
+        with metrics.stage('source_read', file=item) as m:
+            file_bytes = source.read(item, stat)
+            m['input_bytes'] = len(file_bytes)
     except ConnectionError:
         logger.error(f"Не могу подключиться к папке с отчетами:")
         logger.error(ConnectionError)
+        return None
+    return stat, None, file_bytes
+
+
+def load_report(item, fetched=None):
+    """
+    Получаем разобранную выгрузку. Если файл на сервере не менялся, берём результат из кэша
+    :param item: -> str - Имя файла
+    :param fetched: tuple - Результат fetch_report, если файл уже скачан заранее
+    :return: DataFrame с колонками из колонки "Дополнительная информация"
+    """
+    if fetched is None:
+        fetched = fetch_report(item)
+    if fetched is None:
+        return None
+    stat, df, file_bytes = fetched
+    if df is not None:
+        return df
+
+    location = report_source.get_source().location(item)
+    digest = report_cache.content_hash(file_bytes)
+    df = report_cache.lookup_content(location, stat.st_size, stat.st_mtime, digest)
+    if df is not None:
+        logger.info("Содержимое файла не изменилось, берём разобранные данные из кэша")
+        return df
+
+    logger.info("Парсим колонку 'Дополнительная информация'")
+    df = parse_report(file_bytes, item)
+    report_cache.store(location, stat.st_size, stat.st_mtime, digest, df)
+    return df
 
 
 def rebuild_df(df):
@@ -38,43 +166,80 @@ def rebuild_df(df):
     :param df: DataFrame с кроссами из экселя
     :return: Очищенный DataFrame
     """
-    mask_start = df == 'Код'
-    start_row = df[mask_start].dropna(axis=0, how='all').index.values[0]
+    start_row = find_header_row(df)
     df.columns = df.iloc[start_row]
     df = df[start_row + 1:]
     df = df.dropna(axis=1, how='all').set_index('Код')
     return df
 
 
-def split_df(df):
+def find_header_row(df):
+    """
+    Ищем строку заголовка с колонкой "Код" в первых READER['HEADER_ROWS'] строках.
+    Строки проверяются по порядку до первой подходящей, остальная выгрузка не просматривается
+
+    :param df: DataFrame из экселя
+    :return: int - Номер строки заголовка
+    """
+    header_rows = get_option('READER', 'HEADER_ROWS', 100)
+    for row, values in enumerate(df.iloc[:header_rows].itertuples(index=False, name=None)):
+        if 'Код' in values:
+            return row
+    raise ValueError(f"Не нашли колонку 'Код' в первых {header_rows} строках выгрузки")
+
+
+def read_report_columns(file_obj):
+    """
+    Потоково считываем из выгрузки только колонки "Код" и "Дополнительная информация".
+    Строку заголовка ищем в первых READER['HEADER_ROWS'] строках, остальные колонки
+    не декодируются и в DataFrame не попадают
+
+    :param file_obj: Файл выгрузки .xlsx
+    :return: DataFrame с индексом "Код" и колонкой "Дополнительная информация" как после rebuild_df
+    """
+    header_rows = get_option('READER', 'HEADER_ROWS', 100)
+
+    with XlsxSheet(file_obj) as sheet:
+        for header_row, header in sheet.iter_rows(max_row=header_rows):
+            header = dict(zip(sheet.resolve(list(header.values())), header))
+            if 'Код' in header:
+                break
+        else:
+            raise ValueError(f"Не нашли колонку 'Код' в первых {header_rows} строках выгрузки")
+
+        # Декодируем значения только в колонках "Код" и "Дополнительная информация"
+        code_col = header['Код']
+        info_col = header['Дополнительная информация']
+        codes, infos = [], []
+        for _, row in sheet.iter_rows(columns={code_col, info_col}, min_row=header_row + 1):
+            info = row.get(info_col)
+            if info is None:
+                continue
+            codes.append(row.get(code_col))
+            infos.append(info)
+        # Из таблицы общих строк берём только строки этих двух колонок
+        sheet.resolve(codes, infos)
+    return pd.DataFrame({'Дополнительная информация': infos}, index=pd.Index(codes, name='Код'), dtype=object)
+
+
+def split_df(df, source=''):
     """
     Разделяем на отдельные колонки данные из колонки "Дополнительная информация"
     :param df: DataFrame с колонкой "Дополнительная информация"
+    :param source: str - Имя файла выгрузки, используется для файла карантина
     :return: DataFrame с колонками из колонки "Дополнительная информация"
     """
-    # Разбиваем на колонки по разделителю - ";"
-    df_temp1 = df['Дополнительная информация'].str.split(';', expand=True)
-
-    # Объединяем все колонки в одну
-    df_temp = pd.DataFrame()
-    for i in df_temp1.columns:
-        # Берём каждую колонку по порядку без пустых значений
-        df_temp2 = df_temp1[[i]].dropna(how='all', axis=0).copy()
-        # Изменяем наименование колонки как у первой
-        df_temp2.columns = [0]
-        # Объединяем в один DataFrame
-        df_temp = pd.concat([df_temp, df_temp2])
+    if transform_engine() == 'polars':
+        return split_df_polars(df, source)
 
-    # Разделяем на колонки по разделителю - "/"
-    df_result = df_temp[0].str.split('/', expand=True)
+    # Разбиваем ячейки на записи и поля
+    df_result = split_records(df['Дополнительная информация'])
 
-    # Используем для тестов в случае возникновения ошибок
-    problematic_rows = find_problematic_rows(df_result)
-    print(f"Проблемные строки: {problematic_rows}")
+    # Проверяем записи, ошибочные записи отправляем в карантин
+    df_result = validate_records(df_result, source)
 
     # Меняем формат Даты
-    df_result[0] = pd.to_datetime(df_result[0], format="%d.%m.%Y %H:%M:%S")
-    df_result[0] = df_result[0].dt.floor('D')
+    df_result[0] = parse_dates(df_result[0])
 
     # Удаляем дубликаты по первой и второй колонке
     df_result = df_result.drop_duplicates(subset=[0, 1, 4])
@@ -84,21 +249,243 @@ def split_df(df):
     return df_result
 
 
-def find_problematic_rows(df_result):
+def transform_engine():
+    """
+    Движок разбора записей: TRANSFORM['ENGINE'] = 'pandas' (по умолчанию) или 'polars'.
+    Результат у движков одинаковый, polars разбирает строки в несколько потоков одним планом запроса
+    """
+    engine = get_option('TRANSFORM', 'ENGINE', 'pandas')
+    if engine == 'polars' and pl is None:
+        logger.warning("Пакет polars не установлен, записи разбираются в pandas")
+        return 'pandas'
+    return engine
+
+
+def split_df_polars(df, source=''):
+    """
+    Разбираем записи как split_df одним ленивым запросом polars: разбиение ячеек на записи и поля,
+    проверка записей, разбор дат и удаление дубликатов выполняются за один проход по данным
+
+    :param df: DataFrame с колонкой "Дополнительная информация"
+    :param source: str - Имя файла выгрузки, используется для файла карантина
+    :return: DataFrame как у split_df
+    """
+    column = df['Дополнительная информация']
+    cells = column[column.str.len().notna()]
+
+    def field(i):
+        return pl.col('fields').list.get(i, null_on_oob=True)
+
+    date = field(0)
+    # Несуществующий день (31.02, 00.03, месяц 13) при strict=False даёт null и уходит в карантин
+    day = date.str.slice(0, 10).str.to_date('%d.%m.%Y', strict=False)
+    date_ok = date.str.contains(r'^[0-9]{2}\.[0-9]{2}\.[0-9]{4} ([01][0-9]|2[0-3]):[0-5][0-9]:[0-5][0-9]$') & \
+        day.is_not_null() & day.dt.year().is_between(*DATE_YEARS)
+    filled = ~((date == '') & (pl.col('fields').list.len() == 1))
+
+    records = (
+        pl.LazyFrame({'cell': np.arange(len(cells), dtype=np.int64), 'record': cells.tolist()},
+                     schema={'cell': pl.Int64, 'record': pl.String})
+        .with_columns(pl.col('record').str.split(';'))
+        .with_columns(position=pl.int_ranges(pl.col('record').list.len()))
+        .explode(['record', 'position'])
+        # Порядок записей как в split_records: сначала все первые записи ячеек, затем вторые и т.д.
+        .sort(pl.col('position') * len(cells) + pl.col('cell'))
+        .with_columns(fields=pl.col('record').str.split('/'))
+        .with_columns(reason=pl.when(pl.col('fields').list.len() != RECORD_FIELDS).then(pl.lit('Количество полей'))
+                      .when(~date_ok).then(pl.lit('Формат даты'))
+                      .when(field(1) == '').then(pl.lit('Нет ИК сотрудника'))
+                      .when(field(4) == '').then(pl.lit('Нет номера группы'))
+                      .otherwise(pl.lit('')))
+        .filter(filled)
+    )
+    good = (
+        records.filter(pl.col('reason') == '')
+        .select(pl.col('cell'), day.alias('Дата'),
+                field(1).alias('ИК сотрудника'), field(2).alias('Код источник'),
+                field(3).alias('Код добавленный'), field(4).alias('Номер группы'))
+        .unique(subset=['Дата', 'ИК сотрудника', 'Номер группы'], keep='first', maintain_order=True)
+    )
+    bad = records.filter(pl.col('reason') != '').select('cell', 'record', 'reason')
+    good, bad = pl.collect_all([good, bad])
+
+    codes = cells.index.to_numpy()
+    write_quarantine(codes[bad['cell'].to_numpy()], bad['record'].to_numpy(), bad['reason'].to_numpy(), source)
+    return pd.DataFrame({
+        'Дата': good['Дата'].cast(pl.Datetime('ns')).to_numpy(),
+        **{name: good[name].to_numpy().astype(object) for name in
+           ['ИК сотрудника', 'Код источник', 'Код добавленный', 'Номер группы']},
+    }, index=pd.Index(codes[good['cell'].to_numpy()], name=cells.index.name))
+
+
+def split_records(column):
+    """
+    Разбиваем ячейки на записи по разделителю ";" и записи на поля по разделителю "/"
+    :param column: Series - колонка "Дополнительная информация"
+    :return: DataFrame - одна запись на строку, колонки с номерами полей. Отсутствующие поля - NaN
+    """
+    # Оставляем ячейки с текстом и считаем количество записей в каждой
+    cells = column[column.str.len().notna()]
+    counts = cells.str.count(';').to_numpy(dtype='int64') + 1
+    if counts.sum() == 0:
+        return pd.DataFrame(columns=range(RECORD_FIELDS), dtype=object)
+
+    # Считаем количество полей в каждой записи по позициям разделителей ";" и "/"
+    text = ';'.join(cells.tolist()) + ';'
+    data = np.frombuffer(text.encode('utf-8'), dtype=np.uint8)
+    slashes = np.searchsorted(np.flatnonzero(data == ord('/')), np.flatnonzero(data == ord(';')))
+    fields = np.diff(slashes, prepend=0) + 1
+    max_fields = max(int(fields.max()), RECORD_FIELDS)
+
+    # Разбираем все записи за один проход парсером csv: записи разделены ";", поля - "/"
+    df_result = pd.read_csv(io.StringIO(text), sep='/', header=None, names=range(max_fields), dtype=str,
+                            quoting=csv.QUOTE_NONE, lineterminator=';', skip_blank_lines=False,
+                            keep_default_na=False, na_values=[])
+
+    # Отсутствующие поля коротких записей заменяем на NaN, чтобы отличать их от пустых полей
+    for i in range(1, max_fields):
+        short = fields <= i
+        if short.any():
+            df_result.loc[short, i] = np.nan
+
+    # Сохраняем порядок записей как при разбиении на колонки: сначала все первые записи ячеек,
+    # затем все вторые и т.д. От порядка зависит, какая запись останется после удаления дубликатов
+    position = np.arange(len(df_result)) - np.repeat(np.cumsum(counts) - counts, counts)
+    order = np.argsort(position, kind='stable')
+    df_result = df_result.iloc[order]
+    df_result.index = pd.Index(np.repeat(cells.index.to_numpy(), counts)[order], name=cells.index.name)
+    return df_result
+
+
+def validate_records(df_result, source=''):
+    """
+    Проверяем записи сразу целиком: количество полей, формат даты, заполненность ИК сотрудника
+    и номера группы. Ошибочные записи сохраняем в карантин, пустые записи пропускаем
+
+    :param df_result: DataFrame из split_records
+    :param source: str - Имя файла выгрузки, используется для файла карантина
+    :return: DataFrame с корректными записями и колонками 0..RECORD_FIELDS-1
+    """
+    fields_ok = df_result[RECORD_FIELDS - 1].notna().to_numpy()
+    if df_result.shape[1] > RECORD_FIELDS:
+        fields_ok &= df_result[RECORD_FIELDS].isna().to_numpy()
+    reasons = np.select(
+        [
+            ~fields_ok,
+            ~match_date_format(date_chars(df_result[0])),
+            (df_result[1] == '').to_numpy(),
+            (df_result[4] == '').to_numpy(),
+        ],
+        ['Количество полей', 'Формат даты', 'Нет ИК сотрудника', 'Нет номера группы'],
+        default=''
+    )
+    # Пустая запись появляется, например, из-за ";" в конце ячейки
+    filled = ~((df_result[0].fillna('') == '') & df_result[1].isna()).to_numpy()
+    bad = filled & (reasons != '')
+    quarantine_records(df_result[bad], reasons[bad], source)
+    return df_result.loc[filled & ~bad, list(range(RECORD_FIELDS))]
+
+
+def quarantine_records(df_bad, reasons, source=''):
+    """
+    Сохраняем ошибочные записи в файл карантина вместо остановки отчета.
+    Для каждого файла выгрузки свой файл карантина, он перезаписывается при каждом разборе выгрузки
+
+    :param df_bad: DataFrame с ошибочными записями
+    :param reasons: numpy массив с причинами ошибок
+    :param source: str - Имя файла выгрузки
+    """
+    records = df_bad.apply(lambda row: '/'.join(row.dropna()), axis=1).values if not df_bad.empty else []
+    write_quarantine(df_bad.index, records, reasons, source)
+
+
+def write_quarantine(codes, records, reasons, source=''):
+    """
+    Записываем файл карантина
+    :param codes: Коды товаров ошибочных записей
+    :param records: Тексты ошибочных записей
+    :param reasons: Причины ошибок
+    :param source: str - Имя файла выгрузки
+    """
+    path = get_option('QUARANTINE', 'PATH', 'quarantine')
+    file_name = os.path.join(path, f"{os.path.splitext(source)[0] or 'report'}.csv")
+    if len(reasons) == 0:
+        if os.path.exists(file_name):
+            os.remove(file_name)
+        return
+
+    os.makedirs(path, exist_ok=True)
+    df_quarantine = pd.DataFrame({'Код': codes, 'Запись': records, 'Причина': reasons})
+    df_quarantine.to_csv(file_name, sep=';', index=False, encoding='utf-8-sig')
+    summary = ', '.join(f"{k}: {v}" for k, v in df_quarantine['Причина'].value_counts().items())
+    logger.warning(f"В карантин '{file_name}' отправлено записей: {len(df_quarantine)} ({summary})")
+
+
+def date_chars(dates):
     """
-    Проверка на ошибки при преобразовании первой колонки в дату
+    Представляем строки с датами матрицей кодов символов относительно '0'
+    :param dates: Series со строками дат
+    :return: numpy массив размером (кол-во строк, DATE_LENGTH + 1)
     """
-    problematic_indices = []
+    width = DATE_LENGTH + 1
+    chars = dates.fillna('').to_numpy(dtype=f'U{width}').view(np.uint32).reshape(-1, width)
+    return chars.astype(np.int64) - ord('0')
 
-    for idx, value in enumerate(df_result[0]):
-        try:
-            pd.to_datetime(value, format="%d.%m.%Y %H:%M:%S")
-        except ValueError:
-            problematic_indices.append(idx)
-            print(f"Ошибка в строке {idx}: '{value}'")
-            print(f"Строка: {df_result.iloc[idx]}")
 
-    return problematic_indices
+def match_date_format(chars):
+    """
+    Проверяем формат "%d.%m.%Y %H:%M:%S" сразу для всех строк, в том числе что такой день есть в календаре
+    :param chars: numpy массив из date_chars
+    :return: numpy массив bool - строка в нужном формате
+    """
+    digits = chars[:, DATE_DIGITS]
+    result = ((digits >= 0) & (digits <= 9)).all(axis=1)
+    for pos, sep in DATE_SEPARATORS.items():
+        result &= chars[:, pos] == ord(sep) - ord('0')
+    result &= chars[:, DATE_LENGTH] == -ord('0')  # Строка не длиннее формата
+    result &= (date_number(chars, 11, 13) <= 23) & (date_number(chars, 14, 16) <= 59) & \
+              (date_number(chars, 17, 19) <= 59)
+
+    # Несуществующие дни, например 31.02 или 00.03, и месяцы вне 1..12
+    day, month, year = date_number(chars, 0, 2), date_number(chars, 3, 5), date_number(chars, 6, 10)
+    month_ok = (month >= 1) & (month <= 12)
+    leap = (year % 4 == 0) & ((year % 100 != 0) | (year % 400 == 0))
+    days = np.array(DAYS_IN_MONTH)[np.where(month_ok, month, 0)] + (leap & (month == 2))
+    result &= month_ok & (day >= 1) & (day <= days) & (year >= DATE_YEARS[0]) & (year <= DATE_YEARS[1])
+    return result
+
+
+def date_number(chars, start, end):
+    """Получаем число из цифр даты в позициях [start, end)"""
+    result = np.zeros(len(chars), dtype=np.int64)
+    for pos in range(start, end):
+        result = result * 10 + chars[:, pos]
+    return result
+
+
+def parse_dates(dates):
+    """
+    Преобразуем строки формата "%d.%m.%Y %H:%M:%S" в даты с точностью до дня.
+    Строки в ожидаемом формате разбираем массивами numpy без построчного цикла,
+    иначе разбираем через pd.to_datetime
+
+    :param dates: Series со строками дат
+    :return: Series с датами
+    """
+    chars = date_chars(dates)
+    filled = dates.notna().to_numpy()
+    if not match_date_format(chars)[filled].all():
+        return pd.to_datetime(dates, format="%d.%m.%Y %H:%M:%S").dt.floor('D')
+
+    chars = chars[filled]
+    days = pd.to_datetime(pd.DataFrame({
+        'year': date_number(chars, 6, 10),
+        'month': date_number(chars, 3, 5),
+        'day': date_number(chars, 0, 2),
+    }))
+    values = np.full(len(dates), np.datetime64('NaT'), dtype='datetime64[ns]')
+    values[filled] = days.to_numpy()
+    return pd.Series(values, index=dates.index, name=dates.name)
 
 
 def date_report():
@@ -129,11 +516,29 @@ def filter_df_by_date(df, date_filter: datetime, month_report=False, year_report
         date_filter_start = datetime(date_filter.year, date_filter.month, 1)
         date_filter_end = datetime(date_filter.year, date_filter.month, 1) + relativedelta(months=1)
     else:
-        exit()
+        raise ValueError("Не задан период фильтра: передайте month_report или year_report")
     # logger.info(f"Оставляем в отчете данные за период: {period}")
-    df = df.loc[df['Дата'] >= date_filter_start]
-    df = df.loc[df['Дата'] < date_filter_end]
-    return df
+    return filter_df_by_range(df, date_filter_start, date_filter_end)
+
+
+def filter_df_by_range(df, date_start, date_end):
+    """
+    Оставляем в DataFrame данные за период [date_start, date_end)
+    :param df: DataFrame с колонкой 'Дата'
+    :param date_start: datetime - Начало периода
+    :param date_end: datetime - Конец периода, не включается
+    :return: DataFrame с данными за период
+    """
+    return df.loc[(df['Дата'] >= date_start) & (df['Дата'] < date_end)]
+
+
+def report_period():
+    """
+    Период ежемесячного отчета по дате отчета
+    :return: ReportPeriod
+    """
+    date = date_report()
+    return report_periods.month_period(date.year, date.month)
 
 
 def count_add_cross(df):
@@ -144,101 +549,504 @@ def count_add_cross(df):
 
     :return: DataFrame - Количество уникальных связей и ИК-сотрудника
     """
-    df = df.groupby('ИК сотрудника', as_index=False).count()
-    sort_df = df.sort_values('Номер группы', ascending=False)[['ИК сотрудника', 'Номер группы']]
-    sort_df.rename(columns={'Номер группы': 'Кол-во связей'}, inplace=True)
+    df = df.groupby('ИК сотрудника', as_index=False, observed=True).count()
+    return sort_cross_count(df)
+
+
+def sort_cross_count(df, column='Номер группы'):
+    """
+    Сортируем количество связей по ИК-сотрудника по убыванию
+
+    :param df: DataFrame - колонки 'ИК сотрудника' и column с количеством связей
+    :param column: str - Колонка с количеством связей
+    :return: DataFrame - Количество уникальных связей и ИК-сотрудника
+    """
+    sort_df = df.sort_values(column, ascending=False)[['ИК сотрудника', column]]
+    sort_df.rename(columns={column: 'Кол-во связей'}, inplace=True)
     return sort_df
 
 
-def get_report_cross():
+def daily_counts(df):
+    """
+    Сворачиваем записи в количество связей по дням, ИК сотрудника и типу связи
+    :param df: DataFrame из compact_records
+    :return: DataFrame с колонками 'Дата', 'ИК сотрудника', 'Тип связи', 'Связей'
+    """
+    return df.groupby(['Дата', 'ИК сотрудника', 'Тип связи'], observed=True).size().rename('Связей').reset_index()
+
+
+def rollup_records(df_dict):
+    """
+    Переводим DataFrame по типам связи в количество связей по дням, если они ещё не свёрнуты.
+    Отчеты строятся по свёрнутым данным, их объём зависит от количества сотрудников и дней, а не связей
+    :param df_dict: dict - DataFrame из compact_records или daily_counts
+    :return: dict - DataFrame как у daily_counts
+    """
+    with metrics.stage('rollup_records', rows=len(df_dict.get('T', []))) as m:
+        df_dict = {key: df if 'Связей' in df else daily_counts(df) for key, df in df_dict.items()}
+        m['out_rows'] = len(df_dict.get('T', []))
+    return df_dict
+
+
+def build_cross_cube(df_dict):
+    """
+    Считаем количество связей по типу связи, месяцу и ИК-сотрудника одной группировкой по каждому DataFrame
+
+    :param df_dict: dict - Количество связей по дням за год отчета по типам связи из rollup_records
+    :return: Series - Количество связей с индексом (Тип связи, Месяц, ИК сотрудника)
+    """
+    counts = {}
+    for key, df in df_dict.items():
+        month = df['Дата'].dt.month.rename('Месяц')
+        counts[key] = df.groupby([month, 'ИК сотрудника'], observed=True)['Связей'].sum()
+    return pd.concat(counts, names=['Тип связи'])
+
+
+def month_cross_count(cube, key, month):
+    """
+    Получаем из куба количество связей за месяц по типу связи, как в count_add_cross
+
+    :param cube: Series из build_cross_cube
+    :param key: str - Тип связи
+    :param month: int - Номер месяца
+    :return: DataFrame - Количество уникальных связей и ИК-сотрудника
+    """
+    try:
+        df = cube.loc[(key, month)].reset_index()
+    except KeyError:
+        df = pd.DataFrame(columns=['ИК сотрудника', 'Связей'])
+    return sort_cross_count(df, 'Связей')
+
+
+def compact_records(df, key, keep_codes=None):
+    """
+    Переводим записи в компактный вид: ИК сотрудника и тип связи - категории,
+    номер группы - целое число, коды товаров убираем, если они не нужны
+
+    :param df: DataFrame - результат split_df
+    :param key: str - Тип связи
+    :param keep_codes: bool - Оставить коды товаров и индекс "Код". None - по RECORDS['KEEP_CODES']
+    :return: DataFrame с колонками REPORT_COLUMNS и, при необходимости, CODE_COLUMNS
+    """
+    if keep_codes is None:
+        keep_codes = get_option('RECORDS', 'KEEP_CODES', False)
+    df = df[['Дата', 'ИК сотрудника', 'Номер группы'] + (CODE_COLUMNS if keep_codes else [])]
+    if not keep_codes:
+        df = df.reset_index(drop=True)
+
+    df = df.assign(**{
+        'ИК сотрудника': df['ИК сотрудника'].astype(str).astype('category'),
+        'Номер группы': group_numbers(df['Номер группы']),
+        'Тип связи': link_type_column(key, len(df)),
+    })
+    return df[REPORT_COLUMNS + (CODE_COLUMNS if keep_codes else [])]
+
+
+def compact_counts(df, key):
+    """
+    Приводим свёртку по дням из хранилища к виду daily_counts
+    :param df: DataFrame из link_store.load_counts
+    :param key: str - Тип связи
+    :return: DataFrame с колонками 'Дата', 'ИК сотрудника', 'Тип связи', 'Связей'
+    """
+    return pd.DataFrame({
+        'Дата': df['Дата'],
+        'ИК сотрудника': df['ИК сотрудника'].astype(str).astype('category'),
+        'Тип связи': link_type_column(key, len(df)),
+        'Связей': df['Связей'].astype('int64'),
+    })
+
+
+def link_type_column(key, length):
+    """Колонка с одним типом связи длиной length"""
+    return pd.Categorical.from_codes(np.full(length, LINK_TYPES.index(key)), LINK_TYPES)
+
+
+def group_numbers(column):
+    """
+    Переводим номера групп в наименьший подходящий целый тип.
+    Если среди номеров есть не числа, оставляем их категориями
+    :param column: Series с номерами групп
+    :return: Series
+    """
+    numbers = pd.to_numeric(column, errors='coerce')
+    if numbers.notna().all() and (numbers % 1 == 0).all():
+        return pd.to_numeric(numbers.astype('int64'), downcast='integer')
+    return column.astype(str).astype('category')
+
+
+def concat_records(frames):
+    """
+    Объединяем записи по всем типам связи одним pd.concat. Категории ИК сотрудника приводим
+    к общему отсортированному списку, иначе после объединения колонка стала бы строковой
+
+    :param frames: list - DataFrame из compact_records
+    :return: DataFrame
+    """
+    frames = [df for df in frames if df is not None]
+    if not frames:
+        return pd.DataFrame(columns=REPORT_COLUMNS)
+    employees = sorted(set().union(*(df['ИК сотрудника'].cat.categories for df in frames)))
+    frames = [df.assign(**{'ИК сотрудника': df['ИК сотрудника'].cat.set_categories(employees)}) for df in frames]
+    return pd.concat(frames)
+
+
+def bytes_per_million(df):
+    """Память под записи DataFrame в пересчёте на 1 млн записей"""
+    if df.empty:
+        return 0
+    return int(df.memory_usage(index=True, deep=True).sum() / len(df) * 10 ** 6)
+
+
+def connect_share():
+    """
+    Подключаемся к источнику выгрузок.
+    Вызывается в основном процессе и при запуске каждого процесса из пула
+    """
+    report_source.get_source().connect()
+
+
+def process_report(item, fetched=None, date_range=None):
+    """
+    Обрабатываем один файл с отчетом: считываем, разбираем и оставляем данные за период отчетов
+    :param item: -> str - Имя файла в источнике выгрузок
+    :param fetched: tuple - Результат fetch_report, если файл уже скачан заранее
+    :param date_range: tuple - Период данных (начало, конец). None - год отчета
+    :return: DataFrame с данными за период или None, если файл не удалось прочитать
+    """
+    df_cross = load_report(item, fetched)
+    if df_cross is None:
+        return None
+
+    if link_store.is_enabled():
+        # Хранилище пополняется за целые годы, период отчетов применяется при чтении свёртки
+        date_range = store_range(date_range)
+
+    logger.info("Оставляем данные за период отчетов")
+    with metrics.stage('filter_df_by_date', file=item) as m:
+        if date_range is None:
+            df_cross = filter_df_by_date(df_cross, date_report(), year_report=True)
+        else:
+            df_cross = filter_df_by_range(df_cross, *date_range)
+        m['rows'] = len(df_cross)
+
+    # Для хранилища коды товаров сохраняем, из отчетов они убираются при чтении из хранилища
+    keep_codes = True if link_store.is_enabled() else None
+    with metrics.stage('compact_records', file=item) as m:
+        df_cross = compact_records(df_cross, link_type(item), keep_codes)
+        m['rows'] = len(df_cross)
+    return df_cross
+
+
+def process_reports(list_file, date_range=None):
+    """
+    Обрабатываем файлы с отчетами последовательно или в пуле процессов.
+    Количество процессов задаётся в config.PARALLEL['WORKERS'], по умолчанию 1 - без пула
+    :param list_file: list - Имена файлов в источнике выгрузок
+    :param date_range: tuple - Период данных (начало, конец). None - год отчета
+    :return: list - DataFrame по каждому файлу в порядке списка list_file
+    """
+    # Отложенные модули загружаем до запуска потоков и процессов
+    lazy_import.load(np, pd)
+    workers = get_option('PARALLEL', 'WORKERS', 1)
+    if workers <= 1 or len(list_file) <= 1:
+        return prefetch_reports(list_file, date_range)
+
+    logger.info(f"Обрабатываем файлы параллельно в {workers} процессах")
+    with ProcessPoolExecutor(max_workers=min(workers, len(list_file)), initializer=connect_share) as executor:
+        return list(executor.map(partial(process_report, date_range=date_range), list_file))
+
+
+def prefetch_reports(list_file, date_range=None):
+    """
+    Обрабатываем файлы в основном процессе, скачивая следующие файлы в фоновых потоках,
+    пока разбирается текущий. Заранее скачивается не больше PARALLEL['PREFETCH'] файлов
+    (по умолчанию 2), 0 - скачивать файлы по очереди
+
+    :param list_file: list - Имена файлов в источнике выгрузок
+    :param date_range: tuple - Период данных (начало, конец). None - год отчета
+    :return: list - DataFrame по каждому файлу в порядке списка list_file
+    """
+    prefetch = get_option('PARALLEL', 'PREFETCH', 2)
+    if prefetch < 1 or len(list_file) <= 1:
+        return [process_report(item, date_range=date_range) for item in list_file]
+
+    result = []
+    items = iter(list_file)
+    with ThreadPoolExecutor(max_workers=prefetch, thread_name_prefix='prefetch') as executor:
+        queue = deque((item, executor.submit(fetch_report, item))
+                      for item in itertools.islice(items, prefetch))
+        while queue:
+            item, future = queue.popleft()
+            fetched = future.result()
+            # Освободившееся место в очереди занимаем следующим файлом и разбираем текущий
+            for item_next in itertools.islice(items, 1):
+                queue.append((item_next, executor.submit(fetch_report, item_next)))
+            result.append(process_report(item, fetched, date_range))
+    return result
+
+
+def link_type(item):
+    """
+    Определяем тип связи по имени файла выгрузки
+    :param item: str - Имя файла
+    :return: str - 'А' - аналоги, 'Н' - новый номер, 'М' - остальные связи
+    """
+    if item.find('Аналог (Автомат)') != -1:
+        return 'А'
+    elif item.find('Новый номер (Автомат)') != -1:
+        return 'Н'
+    return 'М'
+
+
+def get_report_cross(rebuild=False, date_range=None):
     """
     Считываем файлы со связями из папки в локальной сети
 
+    :param rebuild: bool - Пересобрать хранилище связей полностью, если оно включено
+    :param date_range: tuple - Период данных (начало, конец) для всех отчетов. None - год отчета
     :return: dict -> c очищенными данными и количеством связей
     """
+    if date_range is None:
+        date = date_report()
+        date_range = datetime(date.year, 1, 1), datetime(date.year + 1, 1, 1)
+
     # Получаем список файлов на сервере
-    smbclient.ClientConfig(username=config.LOCAL_PATH['USER'], password=config.LOCAL_PATH['PSW'])
-    path = config.LOCAL_PATH['PATH']
+    connect_share()
+    list_file = list_reports()
+    logger.info(f"Считываем файлы: {list_file} с локального сервера")
+    list_df = process_reports(list_file, date_range)
+    return combine_reports(list_file, list_df, rebuild, date_range)
+
+
+def list_reports():
+    """
+    Получаем список файлов выгрузок в источнике
+    :return: list - Имена файлов .xlsx, пустой список, если не удалось подключиться к папке с отчетами
+    """
     list_file = []
     try:
-        list_file = smbclient.listdir(path)
+        with metrics.stage('source_listdir'):
+            list_file = report_source.get_source().listdir()
         logger.info(f"Получили список файлов с отчётами: {list_file}")
     except ConnectionError:
         logger.error(f"Не могу подключиться к папке с отчетами:")
         logger.error(ConnectionError)
+    return [item for item in list_file if item.endswith('.xlsx')]
+
+
+def combine_reports(list_file, list_df, rebuild=False, date_range=None):
+    """
+    Собираем данные по файлам в словарь по типам связи: удаляем повторы между файлами
+    и, если хранилище включено, обновляем его
+
+    :param list_file: list - Имена файлов
+    :param list_df: list - DataFrame по каждому файлу, None для непрочитанных файлов
+    :param rebuild: bool - Пересобрать хранилище связей полностью, если оно включено
+    :param date_range: tuple - Период данных (начало, конец). None - год отчета
+    :return: dict -> как в get_report_cross
+    """
+    if dedup_index.is_enabled():
+        list_df = dedup_records(list_df)
+
+    if link_store.is_enabled():
+        return update_link_store(list_file, list_df, rebuild, date_range)
 
     # Обрабатываем файлы с отчетами и сохраняем в словарь
     dict_df = dict()
-    df_cross_total = pd.DataFrame()
-    for item in list_file:
-        if item.endswith('.xlsx'):
-            path_file = path + "\\" + item
+    for item, df_cross in zip(list_file, list_df):
+        if df_cross is None:
+            continue
 
-            logger.info(f"Считываем файл: '{item}' с локального сервера")
-            df_cross = read_report(path_file)
+        logger.info("Сохраняем данные в словарь")
+        dict_df[link_type(item)] = df_cross
 
-            logger.info("Парсим колонку 'Дополнительная информация'")
-            df_cross = rebuild_df(df_cross)  # Очищаем DataFrame
-            df_cross = split_df(df_cross)  # Разделяем по колонкам
+    logger.info("Добавляем общие данные по всем типам связи в словарь")
+    return add_total_records(dict_df, list_df)
 
-            logger.info("Оставляем данные за год отчета")
-            df_cross = filter_df_by_date(df_cross, date_report(), year_report=True)
 
-            logger.info("Добавляем данные в общий DatFrame по всем типам связи")
-            df_cross_total = pd.concat([df_cross_total, df_cross])
+def dedup_records(list_df):
+    """
+    Удаляем связи, которые уже встретились в предыдущих файлах: при пересечении выгрузок
+    связь остаётся в первом файле по порядку списка
+
+    :param list_df: list - DataFrame по каждому файлу, None для непрочитанных файлов
+    :return: list - DataFrame без повторов в том же порядке
+    """
+    index = dedup_index.FingerprintIndex()
+    result = []
+    with metrics.stage('dedup_records') as m:
+        m['rows'] = m['dropped'] = 0
+        for df_cross in list_df:
+            if df_cross is not None:
+                values = dedup_index.fingerprints(df_cross)
+                mask = index.new_mask(values)
+                index.add(values[mask])
+                m['rows'] += len(df_cross)
+                m['dropped'] += len(df_cross) - int(mask.sum())
+                if not mask.all():
+                    df_cross = df_cross.loc[mask]
+            result.append(df_cross)
+    if m['dropped']:
+        logger.info(f"Удалили повторы связей между файлами: {m['dropped']} из {m['rows']}")
+    return result
+
+
+def add_total_records(dict_df, frames):
+    """
+    Добавляем в словарь общий DataFrame по всем типам связи под ключом 'T'
+    :param dict_df: dict - DataFrame по типам связи
+    :param frames: list - DataFrame для объединения
+    :return: dict - dict_df с ключом 'T'
+    """
+    with metrics.stage('concat_records') as m:
+        dict_df['T'] = concat_records(frames)
+        m['rows'] = len(dict_df['T'])
+        m['bytes_per_million'] = bytes_per_million(dict_df['T'])
+    logger.info(f"Строк за период: {m['rows']}, память: {m['bytes_per_million'] / 2 ** 20:.1f} МБ на 1 млн строк")
+    return dict_df
 
-            logger.info("Сохраняем данные в словарь")
-            if item.find('Аналог (Автомат)') != -1:
-                dict_df['А'] = df_cross
-            elif item.find('Новый номер (Автомат)') != -1:
-                dict_df['Н'] = df_cross
-            else:
-                dict_df['М'] = df_cross
 
-    logger.info("Добавляем общие данные в словарь")
-    dict_df['T'] = df_cross_total
+def store_range(date_range=None):
+    """
+    Период данных для хранилища: целые годы, в которые попадает период отчетов.
+    Связи за годы вне периода хранилище не меняет
 
-    return dict_df
+    :param date_range: tuple - Период данных (начало, конец). None - год отчета
+    :return: tuple - (начало, конец) периода [начало, конец)
+    """
+    if date_range is None:
+        date = date_report()
+        return datetime(date.year, 1, 1), datetime(date.year + 1, 1, 1)
+    date_start, date_end = date_range
+    return datetime(date_start.year, 1, 1), datetime((date_end - timedelta(days=1)).year + 1, 1, 1)
 
 
-def report_to_excel(df_dict):
+def update_link_store(list_file, list_df, rebuild=False, date_range=None):
+    """
+    Добавляем в хранилище связи новее последней сохранённой даты по каждому типу связи
+    и получаем из хранилища количество связей по дням за период отчетов
+
+    :param list_file: list - Имена файлов
+    :param list_df: list - DataFrame по каждому файлу
+    :param rebuild: bool - Очистить хранилище и загрузить все данные заново
+    :param date_range: tuple - Период данных (начало, конец). None - год отчета
+    :return: dict -> как в get_report_cross, но уже свёрнутые по дням как в daily_counts
+    """
+    # Объединяем файлы по типам связи
+    dict_new = dict()
+    for item, df_cross in zip(list_file, list_df):
+        if df_cross is not None:
+            dict_new.setdefault(link_type(item), []).append(df_cross)
+
+    if date_range is None:
+        date = date_report()
+        date_range = datetime(date.year, 1, 1), datetime(date.year + 1, 1, 1)
+    conn = link_store.connect()
+    index = None
+    try:
+        with conn:
+            if rebuild:
+                logger.info("Пересобираем хранилище связей полностью")
+                link_store.clear(conn)
+            if dedup_index.is_enabled():
+                with metrics.stage('dedup_index_load') as m:
+                    index = link_store.fingerprint_index(conn, dedup_index.index_path())
+                    m['rows'] = len(index)
+            marks = link_store.watermarks(conn)
+            for key, list_new in dict_new.items():
+                count = link_store.replace_since(conn, key, pd.concat(list_new), marks.get(key), index,
+                                                 store_range(date_range)[1])
+                logger.info(f"Добавили в хранилище связей '{key}' с {marks.get(key)}: {count}")
+        # Индекс сохраняем только после записи связей, иначе он разойдётся с хранилищем
+        if index is not None:
+            index.save(dedup_index.index_path(), link_store.count_links(conn))
+
+        logger.info("Считываем количество связей по дням за период отчетов из хранилища")
+        dict_df = {key: compact_counts(link_store.load_counts(conn, key, *date_range), key)
+                   for key in link_store.link_types(conn)}
+    finally:
+        conn.close()
+
+    return add_total_records(dict_df, list(dict_df.values()))
+
+
+def report_to_excel(df_dict, period=None):
     """
     Сохраняем отчёт в эксель
-    :param df_dict:
+    :param df_dict: dict - DataFrame по типам связи и общий под ключом 'T'
+    :param period: ReportPeriod - Период отчета. None - ежемесячный отчет по дате отчета
     :return: list -> Имя файла с итоговым отчётом
     """
-    date_report_name = date_report()
-    file_name = f"Связи кроссов на {date_report_name.strftime('%Y-%m')}.xlsx"
+    if period is None:
+        period = report_period()
+    file_name = report_file_name(period)
+    df_dict = rollup_records(df_dict)
+    df_dict = {key: filter_df_by_range(df, period.start, period.end) for key, df in df_dict.items()}
 
     # Открываем файл для записи
-    with pd.ExcelWriter(file_name, engine='xlsxwriter') as writer:
-        workbook = writer.book  # Открываем книгу для записи
-        logger.info('Добавляем в файл отчеты по месяцам')
-        months_reports(writer, workbook, df_dict)
-
-        logger.info('Добавляем отчет колонку с Полугодием')
-        df_year = set_period(df=df_dict['T'])
+    with metrics.stage('report_to_excel', file=file_name, rows=len(df_dict['T'])):
+        # В режиме constant_memory xlsxwriter сразу пишет строки листа в файл, листы месяцев пишутся через SheetBuffer
+        options = {'constant_memory': get_option('REPORT', 'CONSTANT_MEMORY', True)}
+        with pd.ExcelWriter(file_name, engine='xlsxwriter', engine_kwargs={'options': options}) as writer:
+            workbook = writer.book  # Открываем книгу для записи
+            logger.info('Добавляем в файл отчеты по месяцам')
+            with metrics.stage('months_reports'):
+                months_reports(writer, workbook, df_dict, period)
+
+            logger.info('Добавляем отчет колонку с Полугодием')
+            with metrics.stage('set_period'):
+                df_year = set_period(df=df_dict['T'], year=period.start.year)
+
+            logger.info('Записываем данные по Полугодиям')
+            with metrics.stage('total_result_to_xlsx'):
+                total_result_to_xlsx(writer, workbook, data_pt=df_year)
+
+            logger.info('Добавляем отчет за год, если период отчета - весь год')
+            if report_periods.is_whole_year(period):
+                with metrics.stage('year_result_to_xlsx'):
+                    year_result_to_xlsx(writer, workbook, data_pt=df_year, year=period.start.year)
+    return [file_name]
 
-        logger.info('Записываем данные по Полугодиям')
-        total_result_to_xlsx(writer, workbook, data_pt=df_year)
 
-        logger.info('Добавляем отчет за год, если месяц отчета Декабрь')
-        if date_report_name.month == 12:
-            year_result_to_xlsx(writer, workbook, data_pt=df_year)
-    return [file_name]
+def report_file_name(period):
+    """Имя файла отчета за период"""
+    return f"Связи кроссов на {period.name}.xlsx"
 
 
-def months_reports(writer, workbook, df_dict):
-    date = date_report()
-    cur_month = date.month
-    month = 1
-    while month <= cur_month:
-        sheet_name_month_report = str(date.year)[-2:] + '-' + str(month)
-        wks1 = workbook.add_worksheet(sheet_name_month_report)
+def reports_to_excel(df_dict, periods):
+    """
+    Сохраняем отчёты за несколько периодов из одних и тех же данных.
+    При PARALLEL['WORKERS'] > 1 книги записываются в пуле процессов
 
-        # logger.info("Оставляем данные по общему количеству связей за записываемый месяц")
-        df_cross_month_total = filter_df_by_date(df_dict['T'], datetime(date.year, month, 1), month_report=True)
-        df_count_month_total = count_add_cross(df_cross_month_total)
+    :param df_dict: dict - DataFrame по типам связи и общий под ключом 'T' за все периоды
+    :param periods: list - ReportPeriod
+    :return: list -> Имена файлов с отчётами в порядке periods
+    """
+    df_dict = rollup_records(df_dict)
+    workers = get_option('PARALLEL', 'WORKERS', 1)
+    if workers <= 1 or len(periods) <= 1:
+        return [file for period in periods for file in report_to_excel(df_dict, period)]
+
+    logger.info(f"Записываем отчеты параллельно в {workers} процессах")
+    # В процессы передаём только данные за период каждого отчета
+    tasks = [{key: filter_df_by_range(df, period.start, period.end) for key, df in df_dict.items()}
+             for period in periods]
+    with ProcessPoolExecutor(max_workers=min(workers, len(periods))) as executor:
+        return [file for files in executor.map(report_to_excel, tasks, periods) for file in files]
+
+
+def months_reports(writer, workbook, df_dict, period=None):
+    if period is None:
+        period = report_period()
+    year = period.start.year
+    # Считаем количество связей по всем месяцам и типам связи за один проход
+    cube = build_cross_cube(df_dict)
+    for month in report_periods.period_months(period):
+        sheet_name_month_report = str(year)[-2:] + '-' + str(month)
+        wks1 = SheetBuffer(workbook.add_worksheet(sheet_name_month_report))
+
+        df_count_month_total = month_cross_count(cube, 'T', month)
 
         # Определяем кол-во строк первого графика
         skip_row_after_total = len(df_count_month_total)
@@ -247,10 +1055,8 @@ def months_reports(writer, workbook, df_dict):
         row_total, start_col, start_row, table_width = 4, 1, 1, 3
         start_row_type = row_total + skip_row_after_total + 6
 
-        for key, val in df_dict.items():
-            # logger.info("Оставляем данные за месяц отчета по типу связей за записываемый месяц")
-            df_cross = filter_df_by_date(val, datetime(date.year, month, 1), month_report=True)
-            df_cross_count = count_add_cross(df_cross)
+        for key in df_dict:
+            df_cross_count = month_cross_count(cube, key, month)
             header = ''
             if key == 'А':
                 header = 'Аналоги 100%'
@@ -269,84 +1075,100 @@ def months_reports(writer, workbook, df_dict):
                 start_col = 1
                 start_row = row_total
                 df_cross_count = df_count_month_total
-            df_cross_count.to_excel(writer, sheet_name=sheet_name_month_report, startcol=start_col,
-                                    startrow=start_row, index=False, header=False)
-            # Формат заголовка таблицы
-            format_header = workbook.add_format({
-                'font_name': 'Arial',
-                'font_size': '14',
-                'align': 'left',
-                'bold': True
-            })
-
-            # Формат заголовка столбцов
-            format_bold = workbook.add_format({
-                'font_name': 'Arial',
-                'font_size': '10',
-                'align': 'left',
-                'bold': True,
-                'bg_color': '#F4ECC5',
-                'border': True,
-                'border_color': '#CCC085'
-            })
+            for row, values in enumerate(df_cross_count.itertuples(index=False), start_row):
+                wks1.write_row(row, start_col, values)
+            # Форматы заголовка таблицы и заголовка столбцов
+            formats = report_formats(workbook)
 
             # Записываем заголовок таблицы
-            wks1.write(start_row - 3, start_col, header, format_header)
+            wks1.write(start_row - 3, start_col, header, formats['header'])
             # Записываем заголовок колонок
-            wks1.write_row(start_row - 1, start_col, df_cross_count.columns, format_bold)
+            wks1.write_row(start_row - 1, start_col, df_cross_count.columns, formats['bold'])
             # Формат колонок
             wks1.set_column(start_col, start_col + 1, 20, None)
-        month += 1
+        wks1.flush()
     return
 
 
-def send_file_to_mail(files):
+def send_file_to_mail(files, to=None, mailer=None):
     """
     Отправляем файл на почту
     :param files: -> str - Имя файла для отправки
+    :param to: list - Адреса получателей. None - config.TO_EMAILS['TO_CORRECT']
+    :param mailer: send_mail.Mailer - Общее подключение к почтовому серверу для нескольких писем
     :return:
     """
     message = {
         'Subject': f"Отчёт {files[0][:-5]}",
         'email_content': f"Сформирован отчёт: {files[0][:-5]}",
-        'To': config.TO_EMAILS['TO_CORRECT'],
+        'To': config.TO_EMAILS['TO_CORRECT'] if to is None else to,
         'File_name': files,
         'Temp_file': files
     }
-    send_mail.send(message)
+    with metrics.stage('send_file_to_mail', input_bytes=sum(os.path.getsize(file) for file in files)):
+        send_mail.send(message, mailer)
+
+
+def send_reports(files, to=None):
+    """
+    Отправляем отчеты на почту по письму на отчет через одно подключение к серверу.
+    Ошибка отправки одного отчета записывается в журнал и не мешает отправке остальных
 
+    :param files: list - Имена файлов с отчётами
+    :param to: list - Адреса получателей. None - config.TO_EMAILS['TO_CORRECT']
+    :return: list - Отчеты, которые не удалось отправить
+    """
+    logger.info('Отправляем файлы на почту')
+    failed = []
+    with send_mail.Mailer() as mailer:
+        for file in files:
+            try:
+                send_file_to_mail([file], to, mailer)
+            except OSError as error:
+                # smtplib.SMTPException - подкласс OSError
+                logger.error(f"Не удалось отправить отчет {file}: {error}")
+                failed.append(file)
+    return failed
 
-def set_period(df):
-    """Добавляем колонку Период с номером полугодия и Месяц на основании данных из колонки дата"""
+
+def set_period(df, buckets=('Период', 'Месяц'), year=None):
+    """
+    Добавляем колонки периодов на основании данных из колонки дата за один проход по датам.
+    Полугодие, месяц и квартал - упорядоченные категории, неделя - номер недели ISO
+
+    :param df: DataFrame с колонкой 'Дата'
+    :param buckets: Колонки для добавления: 'Период' (полугодие), 'Месяц', 'Квартал', 'Неделя'
+    :param year: int - Год отчёта. None - год даты отчета
+    :return: DataFrame с колонками периодов
+    """
     # Получаем год отчёта
-    year = date_report().year
-
-    # Заполняем колонку период полугодием
-    df['Период'] = 'I Полугодие'
-    mask = df['Дата'] >= datetime.strptime(f'{year}-07', '%Y-%m')
-    df.loc[mask, 'Период'] = 'II Полугодие'
-
-    # Заполняем колонку месяц
-    df['Месяц'] = 'не определено'
-    df.loc[df['Дата'] >= datetime.strptime(f'{year}-01', '%Y-%m'), 'Месяц'] = 'Январь'
-    df.loc[df['Дата'] >= datetime.strptime(f'{year}-02', '%Y-%m'), 'Месяц'] = 'Февраль'
-    df.loc[df['Дата'] >= datetime.strptime(f'{year}-03', '%Y-%m'), 'Месяц'] = 'Март'
-    df.loc[df['Дата'] >= datetime.strptime(f'{year}-04', '%Y-%m'), 'Месяц'] = 'Апрель'
-    df.loc[df['Дата'] >= datetime.strptime(f'{year}-05', '%Y-%m'), 'Месяц'] = 'Май'
-    df.loc[df['Дата'] >= datetime.strptime(f'{year}-06', '%Y-%m'), 'Месяц'] = 'Июнь'
-    df.loc[df['Дата'] >= datetime.strptime(f'{year}-07', '%Y-%m'), 'Месяц'] = 'Июль'
-    df.loc[df['Дата'] >= datetime.strptime(f'{year}-08', '%Y-%m'), 'Месяц'] = 'Август'
-    df.loc[df['Дата'] >= datetime.strptime(f'{year}-09', '%Y-%m'), 'Месяц'] = 'Сентябрь'
-    df.loc[df['Дата'] >= datetime.strptime(f'{year}-10', '%Y-%m'), 'Месяц'] = 'Октябрь'
-    df.loc[df['Дата'] >= datetime.strptime(f'{year}-11', '%Y-%m'), 'Месяц'] = 'Ноябрь'
-    df.loc[df['Дата'] >= datetime.strptime(f'{year}-12', '%Y-%m'), 'Месяц'] = 'Декабрь'
-    return df
+    if year is None:
+        year = date_report().year
+    dates = df['Дата'].dt
+
+    # Номер месяца в году отчета: даты до года отчета - 0 (не определено), после года отчета - декабрь
+    years = dates.year.to_numpy()
+    month = np.where(years < year, 0, np.where(years > year, 12, dates.month.to_numpy())).astype(np.int8)
+
+    columns = {}
+    for bucket in buckets:
+        if bucket == 'Период':
+            columns[bucket] = pd.Categorical.from_codes((month >= 7).astype(np.int8), HALF_YEARS, ordered=True)
+        elif bucket == 'Месяц':
+            columns[bucket] = pd.Categorical.from_codes(month, MONTH_NAMES, ordered=True)
+        elif bucket == 'Квартал':
+            columns[bucket] = pd.Categorical.from_codes(np.where(month > 0, (month - 1) // 3, -1), QUARTERS, ordered=True)
+        elif bucket == 'Неделя':
+            columns[bucket] = dates.isocalendar().week.to_numpy(dtype=np.int8)
+        else:
+            raise ValueError(f"Неизвестный период: {bucket}")
+    return df.assign(**columns)
 
 
 def total_result_to_xlsx(writer, workbook, data_pt):
     """
     Переработка DataFrame и запись в эксель данных
-    :param data_pt: DataFrame для записи
+    :param data_pt: DataFrame для записи - количество связей по дням с колонками периодов
     :param workbook: Книга эксель для записи
     :param writer:
     :return: передача записи дальше
@@ -354,49 +1176,27 @@ def total_result_to_xlsx(writer, workbook, data_pt):
     # Получаем словари форматов для эксель
     year_format, caption_format, sales_type_format, month_format, sum_format, quantity_format = format_custom(workbook)
     # Получаем количество записей по полугодиям.
-    data_pt1 = data_pt.groupby(['Период']).count()['Номер группы']
+    data_pt1 = data_pt.groupby(['Период'], observed=True)['Связей'].sum()
+    if data_pt1.empty:
+        # За период нет связей: листов полугодий нет, книга состоит из пустых листов месяцев
+        return
 
     # Получаем количество записей по сотрудникам в каждом полугодии
-    data_pt2 = data_pt.groupby(['Период', 'ИК сотрудника']).count()['Номер группы']
+    data_pt2 = data_pt.groupby(['Период', 'ИК сотрудника'], observed=True)['Связей'].sum()
+
+    # Получаем количество записей по сотрудникам в каждом месяце полугодия
+    data_pt3 = employee_month_pivot(data_pt, ['Период', 'ИК сотрудника'])
     wks1 = None
 
     for i in data_pt1.index.unique(level=0):  # Цикл по периодам
         start_row = 4  # Задаём первую строку для записи таблицы с данными
-        start_col = 0  # Задаём первую колонку
         sheet_name = i
         if i == 'I Полугодие':
-            months = ['Январь', 'Февраль', 'Март', 'Апрель', 'Май', 'Июнь']
+            months = MONTHS[:6]
         else:
-            months = ['Июль', 'Август', 'Сентябрь', 'Октябрь', 'Ноябрь', 'Декабрь']
-        # Записываем данные по каждому периоду в эксель
-        employee = data_pt2.loc[[i]].sort_values(ascending=False)  # Сортируем кол-во записей по убыванию по сотрудникам
-
-        for k in employee.index.unique(level=1):  # Цикл по сотрудникам
-            start_col = 3
-            # Записываем данные по каждому ИК сотрудника по каждому периоду в эксель
-            employee.loc[[(i, k)]].droplevel(level=0).to_excel(writer, sheet_name=sheet_name, startrow=start_row,
-                                                               startcol=1, header=False)
-            wks1 = writer.sheets[sheet_name]
-            # Поскольку формат индекса изменить нельзя, то перезаписываем наименование каждого
-            # ИК сотрудника и меняем формат
-            wks1.write(f'B{start_row + 1}', k, sales_type_format)
-            # Изменяем формат всей строки для каждого сотрудника с данными о количестве
-            wks1.conditional_format(f'B{start_row + 1}:C{start_row + 1}',
-                                    {'type': 'no_errors', 'format': sales_type_format})
-
-            # Выбираем данные по каждому полугодию и сотруднику и сортируем по дате
-            data_pt4 = data_pt.loc[(data_pt['Период'] == i) & (data_pt['ИК сотрудника'] == k)]
-            employee_month = data_pt4.groupby(['Месяц']).count()['Номер группы']
-
-            for month in months:
-                try:
-                    val = employee_month[month]
-                except KeyError:
-                    val = None
-
-                wks1.write(start_row, start_col, val, quantity_format)
-                start_col += 1
-            start_row += 1  # Изменяем значение стартовой строки для следующих записей
+            months = MONTHS[6:]
+        # Строки пишутся сразу по порядку: в режиме constant_memory в пройденные строки записать нельзя
+        wks1 = workbook.add_worksheet(sheet_name)
 
         # Запись и формат заголовка таблицы
         wks1.write('B2', f'Общее количество связей за {i}', caption_format)
@@ -406,10 +1206,15 @@ def total_result_to_xlsx(writer, workbook, data_pt):
         for ind, m in enumerate(months):
             wks1.write(3, ind + 3, m, year_format)
             wks1.set_column(ind + 3, ind + 3, 10, None)
+
+        # Записываем данные по каждому периоду в эксель
+        employee = data_pt2.loc[i].sort_values(ascending=False)  # Сортируем кол-во записей по убыванию по сотрудникам
+        start_row = write_employee_rows(wks1, start_row, employee, data_pt3.loc[i].reindex(columns=months),
+                                        sales_type_format, quantity_format)
         wks1.set_column('B:B', 16, None)  # Изменяем ширину первой колонки, где расположен Год, Тип продажи и месяц
         wks1.set_column('C:C', 14, None)  # Изменяем ширину и формат колонки с количеством строк
 
-        wks1.autofilter(3, 1, start_row, start_col-1)  # Добавляем фильтр в отчет
+        wks1.autofilter(3, 1, start_row, 2 + len(months))  # Добавляем фильтр в отчет
 
         # Добавление отображение итогов группировок сверху
         wks1.outline_settings(True, False, False, False)
@@ -417,116 +1222,167 @@ def total_result_to_xlsx(writer, workbook, data_pt):
     return
 
 
-def year_result_to_xlsx(writer, workbook, data_pt):
+def year_result_to_xlsx(writer, workbook, data_pt, year=None):
     """
     Переработка DataFrame и запись в эксель данных
-    :param data_pt: DataFrame для записи
+    :param data_pt: DataFrame для записи - количество связей по дням с колонками периодов
     :param workbook: Книга эксель для записи
     :param writer: Писатель
+    :param year: int - Год отчёта. None - год даты отчета
     :return: передача записи дальше
     """
     # Получаем словари форматов для эксель
     year_format, caption_format, sales_type_format, month_format, sum_format, quantity_format = format_custom(workbook)
 
     # Получаем количество записей по сотрудникам за год
-    data_pt2 = data_pt.groupby(['ИК сотрудника']).count()['Номер группы']
-    months = ['Январь', 'Февраль', 'Март', 'Апрель', 'Май', 'Июнь',
-              'Июль', 'Август', 'Сентябрь', 'Октябрь', 'Ноябрь', 'Декабрь']
-    sheet_name = str(date_report().year)
-    # Записываем данные по году в эксель
-    start_row = 4
+    data_pt2 = data_pt.groupby(['ИК сотрудника'], observed=True)['Связей'].sum()
+    months = MONTHS
+    sheet_name = str(date_report().year if year is None else year)
     employee = data_pt2.sort_values(ascending=False)  # Сортируем кол-во записей по убыванию по сотрудникам
-    for k in employee.index.unique(level=0):  # Цикл по сотрудникам
-        start_col = 3
-        # Записываем данные по каждому ИК сотрудника по каждому периоду в эксель
-        employee.loc[[k]].to_excel(writer, sheet_name=sheet_name, startrow=start_row, startcol=1, header=False)
-        wks1 = writer.sheets[sheet_name]
-        # Поскольку формат индекса изменить нельзя, то перезаписываем наименование каждого
-        # ИК сотрудника и меняем формат
-        wks1.write(f'B{start_row + 1}', k, sales_type_format)
-        # Изменяем формат всей строки для каждого сотрудника с данными о количестве
-        wks1.conditional_format(f'B{start_row + 1}:C{start_row + 1}',
-                                {'type': 'no_errors', 'format': sales_type_format})
-
-        # Выбираем данные по каждому полугодию и сотруднику и сортируем по дате
-        data_pt4 = data_pt.loc[(data_pt['ИК сотрудника'] == k)]
-        employee_month = data_pt4.groupby(['Месяц']).count()['Номер группы']
-
-        for month in months:
-            try:
-                val = employee_month[month]
-            except KeyError:
-                val = None
+    if employee.empty:
+        return
+
+    # Строки пишутся сразу по порядку: в режиме constant_memory в пройденные строки записать нельзя
+    wks1 = workbook.add_worksheet(sheet_name)
+    # Запись и формат заголовка таблицы
+    wks1.write('B2', f'Общее количество связей за {sheet_name} год', caption_format)
+    # Запись и формат заголовка колонок таблицы
+    wks1.write('B4', 'ИК Сотрудника', year_format)
+    wks1.write('C4', sheet_name, year_format)
+    for ind, m in enumerate(months):
+        wks1.write(3, ind + 3, m, year_format)
 
-            wks1.write(start_row, start_col, val, quantity_format)
-            start_col += 1
-        start_row += 1  # Изменяем значение стартовой строки для следующих записей
+    # Записываем данные по году в эксель
+    data_pt3 = employee_month_pivot(data_pt, ['ИК сотрудника']).reindex(columns=months)
+    write_employee_rows(wks1, 4, employee, data_pt3, sales_type_format, quantity_format)
+    wks1.set_column('B:B', 16, None)  # Изменяем ширину первой колонки, где расположен Год, Тип продажи и месяц
+    wks1.set_column('C:C', 8, None)  # Изменяем ширину и формат колонки с количеством строк
+    wks1.autofilter('B4:O4')  # Добавляем фильтр в отчет
+
+    # Добавление отображение итогов группировок сверху
+    wks1.outline_settings(True, False, False, False)
+    return
 
-        # Запись и формат заголовка таблицы
-        wks1.write('B2', f'Общее количество связей за {sheet_name} год', caption_format)
-        # Запись и формат заголовка колонок таблицы
-        wks1.write('B4', 'ИК Сотрудника', year_format)
-        wks1.write('C4', sheet_name, year_format)
-        for ind, m in enumerate(months):
-            wks1.write(3, ind + 3, m, year_format)
-        wks1.set_column('B:B', 16, None)  # Изменяем ширину первой колонки, где расположен Год, Тип продажи и месяц
-        wks1.set_column('C:C', 8, None)  # Изменяем ширину и формат колонки с количеством строк
-        wks1.autofilter('B4:O4')  # Добавляем фильтр в отчет
 
-        # Добавление отображение итогов группировок сверху
-        wks1.outline_settings(True, False, False, False)
-    return
+def employee_month_pivot(data_pt, index):
+    """
+    Считаем сводную таблицу количества связей по месяцам
+    :param data_pt: DataFrame с колонками 'Месяц' и 'Связей'
+    :param index: list - Колонки для строк сводной таблицы
+    :return: DataFrame - строки по index, колонки по месяцам. Месяцы без связей - NaN
+    """
+    return data_pt.groupby(index + ['Месяц'], observed=True)['Связей'].sum().unstack('Месяц')
+
+
+def write_employee_rows(wks1, start_row, employee, employee_month, sales_type_format, quantity_format):
+    """
+    Записываем строки сотрудников: ИК сотрудника, итог за период и количество по месяцам
+    :param wks1: Лист эксель для записи
+    :param start_row: int - Первая строка для записи
+    :param employee: Series - Итог за период по ИК сотрудника в порядке записи
+    :param employee_month: DataFrame - Количество по месяцам, строки по ИК сотрудника
+    :param sales_type_format: Формат ИК сотрудника и итога
+    :param quantity_format: Формат количества по месяцам
+    :return: int - Строка после последней записанной
+    """
+    first_row = start_row
+    # Строки сотрудников берём из числового массива по одной, без копии таблицы из объектов Python
+    employee_month = employee_month.reindex(employee.index).to_numpy(dtype=np.float64)
+    for k, total, values in zip(employee.index, employee.tolist(), employee_month):
+        wks1.write(start_row, 1, k, sales_type_format)
+        wks1.write(start_row, 2, total)
+        wks1.write_row(start_row, 3, [None if np.isnan(val) else int(val) for val in values], quantity_format)
+        start_row += 1  # Изменяем значение стартовой строки для следующих записей
+
+    # Изменяем формат строк сотрудников с данными о количестве
+    if start_row > first_row:
+        wks1.conditional_format(first_row, 1, start_row - 1, 2, {'type': 'no_errors', 'format': sales_type_format})
+    return start_row
 
 
 def format_custom(workbook):
-    year_format = workbook.add_format({
-        'font_name': 'Arial',
-        'font_size': '10',
-        'align': 'left',
-        'bold': True,
-        'bg_color': '#F4ECC5',
-        'border': True,
-        'border_color': '#CCC085'
-    })
-    sales_type_format = workbook.add_format({
-        'font_name': 'Arial',
-        'font_size': '8',
-        'align': 'left',
-        'border': True,
-        'border_color': '#CCC085',
-        'bg_color': '#F8F2D8'
-    })
-    month_format = workbook.add_format({
-        'font_name': 'Arial',
-        'font_size': '8',
-        'align': 'right',
-        'bold': False,
-        'border': True,
-        'border_color': '#CCC085'
-    })
-    sum_format = workbook.add_format({
-        'num_format': '# ### ##0.00"р.";[red]-# ##0.00"р."',
-        'font_name': 'Arial',
-        'font_size': '8',
-        'border': True,
-        'border_color': '#CCC085'
-    })
-    quantity_format = workbook.add_format({
-        'num_format': '# ### ##0',
-        'font_name': 'Arial',
-        'font_size': '8',
-        'border': True,
-        'border_color': '#CCC085'
-    })
-    caption_format = workbook.add_format({
-        'font_name': 'Arial',
-        'font_size': '14',
-        'bold': True,
-        'border': True,
-        'border_color': '#CCC085'
-    })
+    formats = report_formats(workbook)
+    return (formats['year'], formats['caption'], formats['sales_type'], formats['month'], formats['sum'],
+            formats['quantity'])
 
-    return year_format, caption_format, sales_type_format, month_format, sum_format, quantity_format
+
+def report_formats(workbook):
+    """
+    Форматы отчета. Создаются один раз на книгу и используются всеми листами
+    :param workbook: Книга эксель для записи
+    :return: dict - Наименование -> формат
+    """
+    formats = getattr(workbook, 'report_formats', None)
+    if formats is not None:
+        return formats
+
+    formats = {
+        'year': {
+            'font_name': 'Arial',
+            'font_size': '10',
+            'align': 'left',
+            'bold': True,
+            'bg_color': '#F4ECC5',
+            'border': True,
+            'border_color': '#CCC085'
+        },
+        'sales_type': {
+            'font_name': 'Arial',
+            'font_size': '8',
+            'align': 'left',
+            'border': True,
+            'border_color': '#CCC085',
+            'bg_color': '#F8F2D8'
+        },
+        'month': {
+            'font_name': 'Arial',
+            'font_size': '8',
+            'align': 'right',
+            'bold': False,
+            'border': True,
+            'border_color': '#CCC085'
+        },
+        'sum': {
+            'num_format': '# ### ##0.00"р.";[red]-# ##0.00"р."',
+            'font_name': 'Arial',
+            'font_size': '8',
+            'border': True,
+            'border_color': '#CCC085'
+        },
+        'quantity': {
+            'num_format': '# ### ##0',
+            'font_name': 'Arial',
+            'font_size': '8',
+            'border': True,
+            'border_color': '#CCC085'
+        },
+        'caption': {
+            'font_name': 'Arial',
+            'font_size': '14',
+            'bold': True,
+            'border': True,
+            'border_color': '#CCC085'
+        },
+        # Заголовок таблицы на листе месяца
+        'header': {
+            'font_name': 'Arial',
+            'font_size': '14',
+            'align': 'left',
+            'bold': True
+        },
+        # Заголовок столбцов на листе месяца
+        'bold': {
+            'font_name': 'Arial',
+            'font_size': '10',
+            'align': 'left',
+            'bold': True,
+            'bg_color': '#F4ECC5',
+            'border': True,
+            'border_color': '#CCC085'
+        },
+    }
+    workbook.report_formats = {name: workbook.add_format(properties) for name, properties in formats.items()}
+    return workbook.report_formats
 
 
 def run_old():
@@ -545,17 +1401,88 @@ def run_old():
     logger.info('Программа завершила работу')
 
 
-def run():
-    # Получаем данные в виде словаря
-    df_dict = get_report_cross()
+def recipients(names):
+    """
+    Собираем адреса получателей из наборов в config.TO_EMAILS
+    :param names: list - Наименования наборов, например ['TO_CORRECT']
+    :return: list - Адреса без повторов
+    """
+    result = []
+    for name in names:
+        if name not in config.TO_EMAILS:
+            raise ValueError(f"Нет набора получателей '{name}' в TO_EMAILS")
+        result += [addr for addr in config.TO_EMAILS[name] if addr not in result]
+    return result
+
+
+def check_reports(periods=None):
+    """
+    Проверяем выгрузки без скачивания и разбора: какие файлы изменились с последнего разбора
+    по сведениям кэша и какие отчеты сформирует запуск
+
+    :param periods: list - ReportPeriod. None - ежемесячный отчет по дате отчета
+    :return: list - Новые и изменившиеся выгрузки
+    """
+    periods = periods or [report_period()]
+    connect_share()
+    source = report_source.get_source()
+    changed = []
+    for item in list_reports():
+        stat = source.stat(item)
+        if report_cache.is_fresh(source.location(item), stat.st_size, stat.st_mtime):
+            logger.info(f"{item}: не изменился, данные возьмём из кэша")
+        else:
+            logger.info(f"{item}: новый или изменился, будет разобран заново")
+            changed.append(item)
+
+    reports = [report_file_name(period) for period in periods]
+    if changed:
+        logger.info(f"Изменились выгрузки: {len(changed)}. Запуск сформирует отчеты: {reports}")
+    else:
+        logger.info(f"Выгрузки не изменились. Запуск сформирует отчеты из кэша: {reports}")
+    return changed
+
+
+def run(rebuild=False, periods=None, to=('TO_CORRECT',), send=True):
+    """
+    Формируем отчеты: выгрузки считываются один раз, книги по всем периодам строятся из общих данных
+
+    :param rebuild: bool - Пересобрать хранилище связей полностью
+    :param periods: list - ReportPeriod. None - ежемесячный отчет по дате отчета
+    :param to: list - Наборы получателей из config.TO_EMAILS
+    :param send: bool - Отправлять отчеты на почту
+    """
+    metrics.start_run()
+    periods = periods or [report_period()]
+    addresses = recipients(to)
+    # Получаем данные в виде словаря за все периоды сразу
+    df_dict = get_report_cross(rebuild, report_periods.periods_range(periods))
     # Записываем полученный данные в эксель
-    file = report_to_excel(df_dict)
-    logger.info(file)
+    files = reports_to_excel(df_dict, periods)
+    logger.info(files)
 
-    logger.info('Отправляем файл на почту')
-    send_file_to_mail(file)
+    if send:
+        send_reports(files, addresses)
+    metrics.finish_run()
     logger.info('Программа завершила работу')
 
 
 if __name__ == '__main__':
-    run()
+    parser = argparse.ArgumentParser(description='Отчет по созданию связей кроссов',
+                                     epilog=report_periods.__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rebuild', action='store_true', help='Пересобрать хранилище связей полностью')
+    parser.add_argument('--period', nargs='+', default=[],
+                        help='Периоды отчетов, по умолчанию - месяц даты отчета. Форматы ниже')
+    parser.add_argument('--to', nargs='+', default=['TO_CORRECT'], help='Наборы получателей из TO_EMAILS')
+    parser.add_argument('--no-mail', action='store_true', help='Не отправлять отчеты на почту')
+    parser.add_argument('--check', action='store_true',
+                        help='Только проверить выгрузки и показать, какие отчеты будут сформированы')
+    args = parser.parse_args()
+    try:
+        report_list = report_periods.parse_periods(args.period)
+    except ValueError as error:
+        parser.error(str(error))
+    if args.check:
+        check_reports(report_list)
+    else:
+        run(rebuild=args.rebuild, periods=report_list, to=args.to, send=not args.no_mail)
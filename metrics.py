@@ -0,0 +1,150 @@
+"""
+Замеры времени и памяти по этапам обработки
+
+Каждый этап записывается отдельной строкой JSON в файл METRICS['PATH'] (по умолчанию metrics.jsonl):
+время работы, процессорное время, пиковый RSS процесса, объём входных данных и количество строк.
+Запись замеров отключается параметром METRICS['ENABLED'] = False.
+В конце запуска в лог выводится сводная таблица по этапам.
+
+Переменная окружения REPORT_PROFILE включает дополнительные замеры:
+    cprofile    - профиль cProfile всего запуска в файл profile-<запуск>.prof
+    tracemalloc - пик выделенной Python памяти по каждому этапу
+"""
+import cProfile
+import json
+import os
+import pstats
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+
+from loguru import logger
+
+from settings import get_option
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+RUN_ID_ENV = 'REPORT_RUN_ID'
+PROFILE_ENV = 'REPORT_PROFILE'
+
+_profiler = None
+
+
+def run_id():
+    """Идентификатор текущего запуска, общий для основного процесса и процессов пула"""
+    return os.environ.get(RUN_ID_ENV, '')
+
+
+def metrics_path():
+    return get_option('METRICS', 'PATH', 'metrics.jsonl')
+
+
+def peak_rss():
+    """
+    Пиковый RSS процесса в байтах или None, если его нельзя получить
+    """
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+def start_run():
+    """
+    Начинаем замеры запуска. Идентификатор запуска передаётся процессам пула через окружение
+    """
+    global _profiler
+    os.environ[RUN_ID_ENV] = datetime.now().strftime('%Y%m%d-%H%M%S') + f'-{os.getpid()}'
+    mode = os.environ.get(PROFILE_ENV, '')
+    if mode == 'cprofile':
+        _profiler = cProfile.Profile()
+        _profiler.enable()
+    elif mode == 'tracemalloc':
+        tracemalloc.start()
+
+
+def write(record):
+    """Добавляем запись в файл замеров"""
+    if not get_option('METRICS', 'ENABLED', True):
+        return
+    with open(metrics_path(), 'a', encoding='utf-8') as fd:
+        fd.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+
+@contextmanager
+def stage(name, file=None, **values):
+    """
+    Замеряем этап обработки
+
+    with metrics.stage('split_df', file=item) as m:
+        df = split_df(df)
+        m['rows'] = len(df)
+
+    :param name: str - Наименование этапа
+    :param file: str - Файл выгрузки, если этап относится к одному файлу
+    :param values: Дополнительные значения записи, например input_bytes
+    """
+    record = {'run': run_id(), 'stage': name, 'file': file, 'pid': os.getpid(), **values}
+    tracing = tracemalloc.is_tracing()
+    if tracing:
+        tracemalloc.reset_peak()
+    wall, cpu = time.perf_counter(), time.process_time()
+    try:
+        yield record
+    finally:
+        record['wall_sec'] = round(time.perf_counter() - wall, 4)
+        record['cpu_sec'] = round(time.process_time() - cpu, 4)
+        record['peak_rss'] = peak_rss()
+        if tracing:
+            record['traced_peak'] = tracemalloc.get_traced_memory()[1]
+        write(record)
+
+
+def finish_run():
+    """
+    Завершаем замеры запуска: сохраняем профиль и выводим сводную таблицу по этапам
+    """
+    global _profiler
+    if _profiler is not None:
+        _profiler.disable()
+        file_name = f'profile-{run_id()}.prof'
+        _profiler.dump_stats(file_name)
+        logger.info(f"Профиль запуска сохранён в {file_name}")
+        pstats.Stats(_profiler).sort_stats('cumulative').print_stats(20)
+        _profiler = None
+    if tracemalloc.is_tracing():
+        tracemalloc.stop()
+    logger.info('Замеры по этапам:\n' + summary())
+
+
+def summary():
+    """
+    Собираем сводную таблицу по этапам текущего запуска, включая процессы пула
+    :return: str - Таблица
+    """
+    totals = {}
+    try:
+        with open(metrics_path(), encoding='utf-8') as fd:
+            for line in fd:
+                record = json.loads(line)
+                if record['run'] != run_id():
+                    continue
+                total = totals.setdefault(record['stage'], {'count': 0, 'wall_sec': 0.0, 'cpu_sec': 0.0,
+                                                            'input_bytes': 0, 'rows': 0, 'peak_rss': 0})
+                total['count'] += 1
+                for key in ('wall_sec', 'cpu_sec', 'input_bytes', 'rows'):
+                    total[key] += record.get(key) or 0
+                total['peak_rss'] = max(total['peak_rss'], record.get('peak_rss') or 0)
+    except OSError:
+        return ''
+
+    lines = [f"{'Этап':<24}{'Кол-во':>8}{'Время, с':>10}{'CPU, с':>10}{'Вход, МБ':>10}{'Строк':>10}{'RSS, МБ':>10}"]
+    for name, total in totals.items():
+        lines.append(f"{name:<24}{total['count']:>8}{total['wall_sec']:>10.2f}{total['cpu_sec']:>10.2f}"
+                     f"{total['input_bytes'] / 2 ** 20:>10.1f}{total['rows']:>10}{total['peak_rss'] / 2 ** 20:>10.0f}")
+    return '\n'.join(lines)
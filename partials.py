@@ -0,0 +1,234 @@
+"""
+Частичные итоги для сбора отчета с нескольких машин
+
+Обработчик запускается рядом с папкой выгрузок филиала (источник задаётся в config.py, раздел SOURCE)
+и сохраняет по каждой выгрузке частичный итог: количество связей по дням, ИК сотрудника и типу связи,
+а также отпечатки связей для удаления повторов. Координатор объединяет частичные итоги из общей папки
+и формирует отчеты. Сами выгрузки на машину координатора не передаются.
+
+Запуск:
+    python partials.py emit partials --worker branch1          - обработчик
+    python partials.py merge partials --period 2026 --no-mail  - координатор
+
+Повторы связей удаляются между всеми частичными итогами, как между файлами в обычном запуске:
+связь остаётся в первом частичном итоге по порядку имён файлов.
+
+Частичный итог хранится в файле .partial.npz: только массивы чисел, дат и строк, без pickle.
+Координатор считывает файлы с allow_pickle=False, поэтому файл в общей папке не может выполнить код,
+а формат не зависит от версий pandas на машинах обработчиков и координатора.
+"""
+import argparse
+import glob
+import os
+import platform
+
+import numpy as np
+import pandas as pd
+from loguru import logger
+
+import dedup_index
+import main
+import metrics
+import report_periods
+
+# Версия формата частичного итога. Координатор не принимает итоги другой версии
+PARTIAL_VERSION = 2
+
+
+def make_partial(df, source=None):
+    """
+    Считаем частичный итог по записям одной выгрузки
+
+    :param df: DataFrame из compact_records
+    :param source: str - Выгрузка, по которой посчитан итог
+    :return: dict - 'counts': DataFrame как у daily_counts,
+                    'fingerprints': отпечатки связей или None, если удаление повторов выключено,
+                    'cells': номер строки counts для каждого отпечатка
+    """
+    groups = df.groupby(['Дата', 'ИК сотрудника', 'Тип связи'], observed=True)
+    partial = {
+        'version': PARTIAL_VERSION,
+        'source': source,
+        'counts': groups.size().rename('Связей').reset_index(),
+        'fingerprints': None,
+        'cells': None,
+    }
+    if dedup_index.is_enabled():
+        partial['fingerprints'] = dedup_index.fingerprints(df)
+        partial['cells'] = groups.ngroup().to_numpy(dtype=np.int32)
+    return partial
+
+
+def write_partial(directory, name, partial):
+    """Сохраняем частичный итог, файл заменяется целиком"""
+    path = os.path.join(directory, name + '.partial.npz')
+    counts = partial['counts']
+    arrays = {
+        'version': np.int64(partial['version']),
+        'source': np.str_(partial['source'] or ''),
+        'dates': counts['Дата'].to_numpy(dtype='datetime64[D]'),
+        'employees': counts['ИК сотрудника'].astype(str).to_numpy(dtype=str),
+        'types': counts['Тип связи'].astype(str).to_numpy(dtype=str),
+        'links': counts['Связей'].to_numpy(dtype=np.int64),
+    }
+    if partial['fingerprints'] is not None:
+        arrays['fingerprints'] = np.asarray(partial['fingerprints'], dtype=np.uint64)
+        arrays['cells'] = np.asarray(partial['cells'], dtype=np.int32)
+    with open(path + '.tmp', 'wb') as fd:
+        np.savez(fd, **arrays)
+    os.replace(path + '.tmp', path)
+    return path
+
+
+def read_partial(path):
+    """
+    Считываем частичный итог из файла
+    :return: dict как у make_partial, колонки 'ИК сотрудника' и 'Тип связи' - строки
+    """
+    with np.load(path, allow_pickle=False) as data:
+        partial = {'version': int(data['version']), 'source': str(data['source'])}
+        if partial['version'] != PARTIAL_VERSION:
+            return partial
+        partial['counts'] = pd.DataFrame({
+            'Дата': data['dates'].astype('datetime64[ns]'),
+            'ИК сотрудника': data['employees'].astype(object),
+            'Тип связи': data['types'].astype(object),
+            'Связей': data['links'].astype(np.int64),
+        })
+        partial['fingerprints'] = data['fingerprints'] if 'fingerprints' in data else None
+        partial['cells'] = data['cells'] if 'cells' in data else None
+    return partial
+
+
+def read_partials(directory):
+    """
+    Считываем частичные итоги из папки по порядку имён файлов
+    :return: list - dict из make_partial
+    """
+    result = []
+    for path in sorted(glob.glob(os.path.join(directory, '*.partial.npz'))):
+        try:
+            partial = read_partial(path)
+        except (OSError, ValueError, KeyError) as error:
+            logger.warning(f"Пропускаем частичный итог {path}: файл не читается ({error})")
+            continue
+        if partial['version'] != PARTIAL_VERSION:
+            logger.warning(f"Пропускаем частичный итог {path}: версия формата {partial['version']}")
+            continue
+        result.append(partial)
+    return result
+
+
+def merge_partials(partials, date_range=None):
+    """
+    Объединяем частичные итоги в данные для отчетов
+
+    :param partials: list - dict из make_partial
+    :param date_range: tuple - Период данных (начало, конец). None - без ограничения
+    :return: dict -> как в get_report_cross, уже свёрнутые по дням как в daily_counts
+    """
+    index = dedup_index.FingerprintIndex()
+    frames = []
+    with metrics.stage('merge_partials') as m:
+        m['rows'] = m['dropped'] = 0
+        for partial in partials:
+            counts = partial['counts']
+            values = partial['fingerprints']
+            if values is not None:
+                # Вычитаем из количества связи, которые уже есть в предыдущих частичных итогах
+                mask = index.new_mask(values)
+                index.add(values[mask])
+                m['dropped'] += int((~mask).sum())
+                if not mask.all():
+                    dropped = np.bincount(partial['cells'][~mask], minlength=len(counts))
+                    counts = counts.assign(**{'Связей': counts['Связей'] - dropped})
+                    counts = counts.loc[counts['Связей'] > 0]
+            m['rows'] += len(counts)
+            frames.append(counts.assign(**{'ИК сотрудника': counts['ИК сотрудника'].astype(str),
+                                           'Тип связи': counts['Тип связи'].astype(str)}))
+    if m['dropped']:
+        logger.info(f"Удалили повторы связей между частичными итогами: {m['dropped']}")
+
+    merged = pd.concat(frames) if frames else pd.DataFrame(columns=['Дата', 'ИК сотрудника', 'Тип связи', 'Связей'])
+    if date_range is not None:
+        merged = main.filter_df_by_range(merged, *date_range)
+    # Одна и та же ячейка может прийти из нескольких частичных итогов
+    merged = merged.groupby(['Дата', 'ИК сотрудника', 'Тип связи'], sort=True)['Связей'].sum().reset_index()
+
+    dict_df = {key: main.compact_counts(df, key) for key, df in merged.groupby('Тип связи')}
+    return main.add_total_records(dict_df, list(dict_df.values()))
+
+
+def emit(directory, periods=None, worker=None):
+    """
+    Обработчик: считываем выгрузки источника и сохраняем частичные итоги в папку
+
+    :param directory: str - Общая папка частичных итогов
+    :param periods: list - ReportPeriod, за которые нужны данные. None - ежемесячный отчет по дате отчета
+    :param worker: str - Имя обработчика в именах файлов. None - имя машины
+    :return: list - Пути к сохранённым частичным итогам
+    """
+    worker = worker or platform.node()
+    date_range = report_periods.periods_range(periods or [main.report_period()])
+    os.makedirs(directory, exist_ok=True)
+    main.connect_share()
+    list_file = main.list_reports()
+    paths = []
+    for item, df_cross in zip(list_file, main.process_reports(list_file, date_range)):
+        if df_cross is None:
+            continue
+        with metrics.stage('write_partial', file=item, rows=len(df_cross)):
+            paths.append(write_partial(directory, f'{worker}-{item}', make_partial(df_cross, f'{worker}/{item}')))
+    logger.info(f"Сохранили частичные итоги: {paths}")
+    return paths
+
+
+def coordinate(directory, periods=None, to=('TO_CORRECT',), send=True):
+    """
+    Координатор: объединяем частичные итоги из папки, формируем и отправляем отчеты
+
+    :param directory: str - Общая папка частичных итогов
+    :param periods: list - ReportPeriod. None - ежемесячный отчет по дате отчета
+    :param to: list - Наборы получателей из config.TO_EMAILS
+    :param send: bool - Отправлять отчеты на почту
+    :return: list - Имена файлов с отчётами
+    """
+    periods = periods or [main.report_period()]
+    addresses = main.recipients(to)
+    partials = read_partials(directory)
+    logger.info(f"Объединяем частичные итоги: {[partial['source'] for partial in partials]}")
+    df_dict = merge_partials(partials, report_periods.periods_range(periods))
+    files = main.reports_to_excel(df_dict, periods)
+    logger.info(files)
+
+    if send:
+        main.send_reports(files, addresses)
+    return files
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Частичные итоги для сбора отчета с нескольких машин',
+                                     epilog=report_periods.__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    parser_emit = subparsers.add_parser('emit', help='Сохранить частичные итоги по выгрузкам источника')
+    parser_emit.add_argument('directory', help='Папка частичных итогов')
+    parser_emit.add_argument('--worker', help='Имя обработчика, по умолчанию - имя машины')
+    parser_merge = subparsers.add_parser('merge', help='Объединить частичные итоги и сформировать отчеты')
+    parser_merge.add_argument('directory', help='Папка частичных итогов')
+    parser_merge.add_argument('--to', nargs='+', default=['TO_CORRECT'], help='Наборы получателей из TO_EMAILS')
+    parser_merge.add_argument('--no-mail', action='store_true', help='Не отправлять отчеты на почту')
+    for subparser in (parser_emit, parser_merge):
+        subparser.add_argument('--period', nargs='+', default=[],
+                               help='Периоды отчетов, по умолчанию - месяц даты отчета. Форматы ниже')
+    args = parser.parse_args()
+    try:
+        report_list = report_periods.parse_periods(args.period)
+    except ValueError as error:
+        parser.error(str(error))
+
+    metrics.start_run()
+    if args.command == 'emit':
+        emit(args.directory, report_list, args.worker)
+    else:
+        coordinate(args.directory, report_list, args.to, send=not args.no_mail)
+    metrics.finish_run()
@@ -0,0 +1,197 @@
+"""
+Кэш разобранных выгрузок со связями
+
+Для каждого файла выгрузки храним результат split_df. Запись кэша привязана к пути файла,
+его размеру и времени изменения на сервере, а также к хэшу содержимого.
+Если размер и время изменения совпадают, файл с сервера не скачивается вовсе.
+Если изменилось только время изменения, а содержимое то же, повторный разбор Excel не выполняется.
+
+Настройки задаются в config.py в разделе CACHE (см. settings.py).
+"""
+import hashlib
+import json
+import os
+
+from loguru import logger
+
+from lazy_import import lazy_import
+from settings import get_option
+
+pd = lazy_import('pandas')
+
+# Версия формата кэша. Увеличиваем при изменении результата разбора выгрузок
+CACHE_VERSION = 2
+
+
+def is_enabled():
+    """Проверяем, включен ли кэш"""
+    return get_option('CACHE', 'ENABLED', True)
+
+
+def cache_dir():
+    """
+    Получаем папку кэша и создаём её при необходимости
+    :return: str - Путь к папке кэша
+    """
+    path = get_option('CACHE', 'PATH', os.path.join('.cache', 'reports'))
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def content_hash(file_bytes):
+    """
+    Считаем хэш содержимого файла
+    :param file_bytes: bytes - Содержимое файла
+    :return: str - sha256 в шестнадцатеричном виде
+    """
+    return hashlib.sha256(file_bytes).hexdigest()
+
+
+def _meta_path(path_file):
+    """Путь к файлу описания записи кэша для файла выгрузки"""
+    name = hashlib.sha1(path_file.encode('utf-8')).hexdigest()
+    return os.path.join(cache_dir(), name + '.json')
+
+
+def _data_path(digest):
+    """Путь к файлу с данными по хэшу содержимого"""
+    return os.path.join(cache_dir(), f"{digest}.v{CACHE_VERSION}.pkl")
+
+
+def _read_meta(path_file):
+    """Считываем описание записи кэша или None, если его нет"""
+    try:
+        with open(_meta_path(path_file), encoding='utf-8') as fd:
+            return json.load(fd)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_meta(path_file, size, mtime, digest):
+    """Сохраняем описание записи кэша. Запись через временный файл, чтобы не оставить битый json"""
+    meta = {'path': path_file, 'size': size, 'mtime': mtime, 'sha256': digest, 'version': CACHE_VERSION}
+    meta_path = _meta_path(path_file)
+    tmp_path = f"{meta_path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as fd:
+        json.dump(meta, fd, ensure_ascii=False)
+    os.replace(tmp_path, meta_path)
+
+
+def _load_data(digest):
+    """Считываем DataFrame из кэша по хэшу содержимого и отмечаем время обращения"""
+    data_path = _data_path(digest)
+    if not os.path.exists(data_path):
+        return None
+    try:
+        df = pd.read_pickle(data_path)
+    except Exception as ex:
+        logger.warning(f"Не удалось прочитать запись кэша {data_path}: {ex}")
+        return None
+    try:
+        os.utime(data_path)  # Время изменения используем как время последнего обращения
+    except FileNotFoundError:
+        pass  # Запись уже удалил другой процесс при освобождении места, данные считаны
+    return df
+
+
+def lookup(path_file, size, mtime):
+    """
+    Ищем разобранную выгрузку в кэше по метаданным файла, без скачивания самого файла
+
+    :param path_file: str - Путь к файлу на сервере
+    :param size: int - Размер файла
+    :param mtime: float - Время изменения файла
+    :return: DataFrame из кэша или None
+    """
+    if not is_enabled():
+        return None
+    meta = _read_meta(path_file)
+    if meta is None or meta.get('version') != CACHE_VERSION:
+        return None
+    if meta['size'] != size or meta['mtime'] != mtime:
+        return None
+    return _load_data(meta['sha256'])
+
+
+def is_fresh(path_file, size, mtime):
+    """
+    Проверяем по описанию записи кэша, что файл не изменился с последнего разбора. Данные не считываются
+
+    :param path_file: str - Путь к файлу на сервере
+    :param size: int - Размер файла
+    :param mtime: float - Время изменения файла
+    :return: bool
+    """
+    if not is_enabled():
+        return False
+    meta = _read_meta(path_file)
+    if meta is None or meta.get('version') != CACHE_VERSION:
+        return False
+    return meta['size'] == size and meta['mtime'] == mtime and os.path.exists(_data_path(meta['sha256']))
+
+
+def lookup_content(path_file, size, mtime, digest):
+    """
+    Ищем разобранную выгрузку в кэше по хэшу содержимого.
+    Используется, когда метаданные файла изменились, а содержимое могло остаться прежним
+
+    :param path_file: str - Путь к файлу на сервере
+    :param size: int - Размер файла
+    :param mtime: float - Время изменения файла
+    :param digest: str - Хэш содержимого файла
+    :return: DataFrame из кэша или None
+    """
+    if not is_enabled():
+        return None
+    df = _load_data(digest)
+    if df is not None:
+        _write_meta(path_file, size, mtime, digest)
+    return df
+
+
+def store(path_file, size, mtime, digest, df):
+    """
+    Сохраняем разобранную выгрузку в кэш и освобождаем место при превышении лимита
+
+    :param path_file: str - Путь к файлу на сервере
+    :param size: int - Размер файла
+    :param mtime: float - Время изменения файла
+    :param digest: str - Хэш содержимого файла
+    :param df: DataFrame - Результат разбора выгрузки
+    """
+    if not is_enabled():
+        return
+    data_path = _data_path(digest)
+    tmp_path = f"{data_path}.{os.getpid()}.tmp"
+    df.to_pickle(tmp_path)
+    os.replace(tmp_path, data_path)
+    _write_meta(path_file, size, mtime, digest)
+    evict()
+
+
+def evict():
+    """
+    Удаляем давно не используемые записи, пока размер кэша больше CACHE['MAX_SIZE_MB'].
+    Папку кэша одновременно могут чистить процессы из пула, записи, удалённые другим процессом, пропускаем
+    """
+    max_size = get_option('CACHE', 'MAX_SIZE_MB', 512) * 1024 * 1024
+    path = cache_dir()
+    entries = []
+    for name in os.listdir(path):
+        if name.endswith('.pkl'):
+            try:
+                stat = os.stat(os.path.join(path, name))
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, name))
+
+    total_size = sum(size for _, size, _ in entries)
+    for _, size, name in sorted(entries):
+        if total_size <= max_size:
+            break
+        total_size -= size
+        try:
+            os.remove(os.path.join(path, name))
+        except FileNotFoundError:
+            continue
+        logger.info(f"Удалили из кэша запись: {name}")
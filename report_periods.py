@@ -0,0 +1,89 @@
+"""
+Периоды отчетов
+
+Период задаётся строкой:
+    2026                  - год: листы всех месяцев, полугодий и лист за год
+    2026-H1               - полугодие (H1 или H2): листы месяцев и полугодия
+    2026-03               - месяц: отчет с начала года по месяц включительно, как ежемесячный отчет
+    2026-01..2026-12      - ряд ежемесячных отчетов, например для пересчёта отчетов за прошлый год
+    2026-02-01:2026-04-15 - произвольный период в пределах одного года, даты включительно
+"""
+from collections import namedtuple
+from datetime import datetime
+
+from dateutil.relativedelta import relativedelta
+
+# Период отчета: наименование для имени файла и границы данных [start, end)
+ReportPeriod = namedtuple('ReportPeriod', ['name', 'start', 'end'])
+
+
+def month_period(year, month):
+    """
+    Ежемесячный отчет: данные с начала года по месяц включительно
+    :return: ReportPeriod
+    """
+    return ReportPeriod(f'{year}-{month:02d}', datetime(year, 1, 1), datetime(year, month, 1) + relativedelta(months=1))
+
+
+def parse_period(text):
+    """
+    Разбираем период из строки, форматы описаны в начале модуля
+    :param text: str - Период
+    :return: list - ReportPeriod, для ряда месяцев по одному на каждый месяц
+    """
+    text = text.strip()
+    try:
+        if '..' in text:
+            first, last = (datetime.strptime(part, '%Y-%m') for part in text.split('..'))
+            periods = []
+            while first <= last:
+                periods.append(month_period(first.year, first.month))
+                first += relativedelta(months=1)
+            if not periods:
+                raise ValueError("первый месяц позже последнего")
+            return periods
+
+        if ':' in text:
+            start, last = (datetime.strptime(part, '%Y-%m-%d') for part in text.split(':'))
+            if start > last or start.year != last.year:
+                raise ValueError("даты должны идти по порядку и быть в пределах одного года")
+            return [ReportPeriod(f'{start:%Y-%m-%d}_{last:%Y-%m-%d}', start, last + relativedelta(days=1))]
+
+        if '-H' in text:
+            year, half = text.split('-H')
+            if half not in ('1', '2'):
+                raise ValueError("полугодие задаётся как H1 или H2")
+            start = datetime(int(year), 1 if half == '1' else 7, 1)
+            return [ReportPeriod(text, start, start + relativedelta(months=6))]
+
+        if len(text) == 4:
+            start = datetime.strptime(text, '%Y')
+            return [ReportPeriod(text, start, start + relativedelta(years=1))]
+
+        date = datetime.strptime(text, '%Y-%m')
+        return [month_period(date.year, date.month)]
+    except ValueError as error:
+        raise ValueError(f"Не могу разобрать период '{text}': {error}") from None
+
+
+def parse_periods(texts):
+    """Разбираем список периодов из строк"""
+    return [period for text in texts for period in parse_period(text)]
+
+
+def period_months(period):
+    """Номера месяцев, которые попадают в период"""
+    return list(range(period.start.month, (period.end - relativedelta(days=1)).month + 1))
+
+
+def is_whole_year(period):
+    """Проверяем, что период - весь год. Тогда в отчет добавляется лист за год"""
+    return period.start == datetime(period.start.year, 1, 1) and period.end == period.start + relativedelta(years=1)
+
+
+def periods_range(periods):
+    """
+    Общий период данных для всех отчетов, чтобы считать выгрузки один раз
+    :return: tuple - (начало, конец) периода [начало, конец)
+    """
+    return min(period.start for period in periods), max(period.end for period in periods)
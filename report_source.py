@@ -0,0 +1,180 @@
+"""
+Источники файлов выгрузок со связями
+
+Настройки задаются в config.py в разделе SOURCE:
+SOURCE = {
+    'TYPE': 'smb',  # smb - сетевая папка LOCAL_PATH, local - локальная папка, mirror - локальная копия LOCAL_PATH
+    'PATH': 'exports',  # Папка с выгрузками для TYPE = 'local'
+    'MIRROR_PATH': 'mirror',  # Папка локальной копии для TYPE = 'mirror'
+}
+
+В режиме mirror файл скачивается с сервера, только если на сервере изменились его размер или дата
+изменения. Локальная копия проверяется по контрольной сумме, повреждённая копия скачивается заново.
+"""
+import hashlib
+import json
+import os
+
+import config
+from loguru import logger
+
+from lazy_import import lazy_import
+from settings import get_option
+
+smbclient = lazy_import('smbclient')
+
+
+class SmbSource:
+    """Сетевая папка с выгрузками"""
+
+    def __init__(self, path, username, password):
+        """
+        :param path: str - Путь к папке вида \\\\сервер\\папка
+        :param username: str - Пользователь
+        :param password: str - Пароль
+        """
+        self.path = path
+        self.username = username
+        self.password = password
+
+    def connect(self):
+        """
+        Задаём учётные данные и открываем сессию с сервером один раз,
+        дальше все файлы читаются через неё из кэша подключений smbclient
+        """
+        smbclient.ClientConfig(username=self.username, password=self.password)
+        server = self.path.lstrip('\\').split('\\')[0]
+        try:
+            smbclient.register_session(server, username=self.username, password=self.password)
+        except (ConnectionError, ValueError) as error:
+            logger.error(f"Не могу подключиться к серверу {server}: {error}")
+
+    def location(self, item):
+        """Полный путь к файлу, используется как ключ кэша"""
+        return self.path + '\\' + item
+
+    def listdir(self):
+        return smbclient.listdir(self.path)
+
+    def stat(self, item):
+        return smbclient.stat(self.location(item))
+
+    def read(self, item, stat=None):
+        """
+        Считываем содержимое файла
+        :param item: str - Имя файла
+        :param stat: Сведения о файле, если уже получены
+        :return: bytes
+        """
+        with smbclient.open_file(self.location(item), mode="rb") as fd:
+            return fd.read()
+
+
+class LocalSource:
+    """Локальная папка с выгрузками"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def connect(self):
+        pass
+
+    def location(self, item):
+        return os.path.join(self.path, item)
+
+    def listdir(self):
+        return sorted(os.listdir(self.path))
+
+    def stat(self, item):
+        return os.stat(self.location(item))
+
+    def read(self, item, stat=None):
+        with open(self.location(item), 'rb') as fd:
+            return fd.read()
+
+
+class MirrorSource:
+    """Локальная копия сетевой папки: с сервера скачиваются только изменившиеся файлы"""
+
+    def __init__(self, remote, path):
+        """
+        :param remote: SmbSource - Сетевая папка
+        :param path: str - Папка локальной копии
+        """
+        self.remote = remote
+        self.local = LocalSource(path)
+
+    def connect(self):
+        self.remote.connect()
+
+    def location(self, item):
+        return self.remote.location(item)
+
+    def listdir(self):
+        return self.remote.listdir()
+
+    def stat(self, item):
+        return self.remote.stat(item)
+
+    def read(self, item, stat=None):
+        """
+        Берём файл из локальной копии, если на сервере он не менялся и копия цела,
+        иначе скачиваем файл и обновляем копию
+        """
+        if stat is None:
+            stat = self.remote.stat(item)
+        meta = self._read_meta(item)
+        if meta is not None and meta['size'] == stat.st_size and meta['mtime'] == stat.st_mtime:
+            try:
+                file_bytes = self.local.read(item)
+            except OSError:
+                file_bytes = None
+            if file_bytes is not None and hashlib.sha256(file_bytes).hexdigest() == meta['sha256']:
+                logger.info(f"Файл {item} не изменился на сервере, берём локальную копию")
+                return file_bytes
+            logger.warning(f"Локальная копия {item} повреждена или отсутствует, скачиваем заново")
+
+        file_bytes = self.remote.read(item)
+        self._write_copy(item, file_bytes, stat)
+        return file_bytes
+
+    def _meta_path(self, item):
+        return os.path.join(self.local.path, '.meta', item + '.json')
+
+    def _read_meta(self, item):
+        try:
+            with open(self._meta_path(item), encoding='utf-8') as fd:
+                return json.load(fd)
+        except (OSError, ValueError):
+            return None
+
+    def _write_copy(self, item, file_bytes, stat):
+        """Сохраняем копию файла и сведения о нём. Файлы заменяются целиком, без частично записанных копий"""
+        os.makedirs(os.path.dirname(self._meta_path(item)), exist_ok=True)
+        file_name = self.local.location(item)
+        with open(file_name + '.tmp', 'wb') as fd:
+            fd.write(file_bytes)
+        os.replace(file_name + '.tmp', file_name)
+
+        meta = {'size': stat.st_size, 'mtime': stat.st_mtime, 'sha256': hashlib.sha256(file_bytes).hexdigest()}
+        meta_name = self._meta_path(item)
+        with open(meta_name + '.tmp', 'w', encoding='utf-8') as fd:
+            json.dump(meta, fd)
+        os.replace(meta_name + '.tmp', meta_name)
+
+
+def get_source():
+    """
+    Создаём источник выгрузок по настройкам SOURCE
+    :return: SmbSource, LocalSource или MirrorSource
+    """
+    kind = get_option('SOURCE', 'TYPE', 'smb')
+    if kind == 'local':
+        return LocalSource(get_option('SOURCE', 'PATH', 'exports'))
+
+    share = SmbSource(config.LOCAL_PATH['PATH'], config.LOCAL_PATH['USER'], config.LOCAL_PATH['PSW'])
+    if kind == 'smb':
+        return share
+    if kind == 'mirror':
+        return MirrorSource(share, get_option('SOURCE', 'MIRROR_PATH', 'mirror'))
+    raise ValueError(f"Неизвестный источник выгрузок SOURCE['TYPE']: {kind}")
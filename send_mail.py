@@ -1,15 +1,274 @@
-from config import EMAIL_CONFIG
-from loguru import logger
+"""
+Отправка писем с отчетами
+
+Одно подключение к SMTP серверу используется для всех писем запуска (Mailer). Вложения кодируются
+в base64 по частям прямо при передаче на сервер, письмо целиком в памяти не собирается.
+Если вложения больше EMAIL_CONFIG['MAX_SIZE_MB'], они раскладываются по нескольким письмам.
+Файл, который сам больше предела, упаковывается в zip и делится на части <имя>.zip.001, .002, ...
+по письму на часть. Части открываются в 7-Zip с первой части или склеиваются в архив: copy /b, cat.
+При временных ошибках сервера письмо отправляется повторно с увеличивающейся паузой.
+
+Необязательные параметры EMAIL_CONFIG в config.py:
+EMAIL_CONFIG = {
+    'FROM': ..., 'PSW': ...,
+    'HOST': 'smtp.yandex.ru',  # SMTP сервер
+    'PORT': 465,  # Порт SMTP сервера
+    'SSL': True,  # Подключение по SSL. False - без шифрования, например для локального тестового сервера
+    'MAX_SIZE_MB': 20,  # Предельный размер вложений одного письма в base64, как его считает сервер
+    'RETRIES': 3,  # Количество повторов при временных ошибках
+    'BACKOFF_SEC': 5,  # Пауза перед первым повтором, дальше удваивается
+}
+"""
+import base64
+import os
 import smtplib  # Импортируем библиотеку по работе с SMTP
+import tempfile
+import time
+import uuid
+import zipfile
+from email import policy
 
 # Добавляем необходимые подклассы - MIME-типы
 from email.mime.multipart import MIMEMultipart  # Многокомпонентный объект
 from email.mime.text import MIMEText  # Текст/HTML
 from email.mime.base import MIMEBase  # Общий тип
-from email import encoders  # Импортируем энкодер
+
+from config import EMAIL_CONFIG
+from loguru import logger
+
+from settings import get_option
+
+# Размер блока файла для кодирования: кратен 57 байтам, из которых получается строка base64 в 76 символов
+ENCODE_BLOCK = 57 * 1024
+# Пояснение в письме с частью архива
+PARTS_NOTE = ("<p>Отчет больше предельного размера письма и отправлен частями архива .zip.001, .zip.002, ... "
+              "в нескольких письмах. Откройте первую часть в 7-Zip или объедините части: "
+              "copy /b имя.zip.001+имя.zip.002 имя.zip</p>")
+
+
+class Mailer:
+    """Подключение к SMTP серверу, которое переиспользуется для нескольких писем"""
+
+    def __init__(self):
+        self.host = get_option('EMAIL_CONFIG', 'HOST', 'smtp.yandex.ru')
+        self.port = get_option('EMAIL_CONFIG', 'PORT', 465)
+        self.ssl = get_option('EMAIL_CONFIG', 'SSL', True)
+        self.retries = get_option('EMAIL_CONFIG', 'RETRIES', 3)
+        self.backoff = get_option('EMAIL_CONFIG', 'BACKOFF_SEC', 5)
+        self.max_size = get_option('EMAIL_CONFIG', 'MAX_SIZE_MB', 20) * 2 ** 20
+        self.server = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def connect(self):
+        """Подключаемся и авторизуемся, если подключения ещё нет"""
+        if self.server is None:
+            server_class = smtplib.SMTP_SSL if self.ssl else smtplib.SMTP
+            self.server = server_class(self.host, self.port)
+            if EMAIL_CONFIG['PSW']:
+                self.server.login(EMAIL_CONFIG['FROM'], EMAIL_CONFIG['PSW'])
+        return self.server
+
+    def close(self):
+        if self.server is not None:
+            try:
+                self.server.quit()
+            except (smtplib.SMTPException, OSError):
+                self.server.close()
+            self.server = None
+
+    def send(self, message):
+        """
+        Отправляем письмо, при большом размере вложений - несколькими письмами
+
+        :param message: dict - Письмо, как в send
+        """
+        addr_to = message['To']
+        logger.info(f"Send message to emails {addr_to}")
+        with tempfile.TemporaryDirectory() as directory:
+            groups = split_files(message['Temp_file'], self.max_size, directory)
+            for number, files in enumerate(groups, 1):
+                subject, content = message['Subject'], message['email_content']
+                if len(groups) > 1:
+                    subject += f" (часть {number} из {len(groups)})"
+                if any(os.path.dirname(file) == directory for file in files):
+                    content += PARTS_NOTE
+                self.deliver(addr_to, subject, content, files)
+        logger.info("Mail sending completed")
+
+    def deliver(self, addr_to, subject, content, files):
+        """Отправляем одно письмо, при временной ошибке переподключаемся и повторяем"""
+        for attempt in range(self.retries + 1):
+            try:
+                return self.transmit(addr_to, subject, content, files)
+            except (smtplib.SMTPException, OSError) as error:
+                # Соединение после ошибки в середине письма непригодно, открываем новое
+                self.close()
+                if not is_transient(error) or attempt == self.retries:
+                    raise
+                delay = self.backoff * 2 ** attempt
+                logger.warning(f"Ошибка отправки письма: {error}. Повтор через {delay} с")
+                time.sleep(delay)
+
+    def transmit(self, addr_to, subject, content, files):
+        """Передаём письмо на сервер частями по мере кодирования"""
+        server = self.connect()
+        server.ehlo_or_helo_if_needed()
+        code, response = server.mail(EMAIL_CONFIG['FROM'])
+        if code != 250:
+            raise smtplib.SMTPSenderRefused(code, response, EMAIL_CONFIG['FROM'])
+        refused = {}
+        for addr in addr_to:
+            code, response = server.rcpt(addr)
+            if code not in (250, 251):
+                refused[addr] = (code, response)
+        if len(refused) == len(addr_to):
+            server.rset()
+            raise smtplib.SMTPRecipientsRefused(refused)
+
+        code, response = server.docmd('DATA')
+        if code != 354:
+            raise smtplib.SMTPDataError(code, response)
+        # Строки письма - заголовки и base64, ни одна не начинается с точки, удваивать точки не нужно
+        try:
+            for chunk in message_chunks(addr_to, subject, content, files):
+                server.send(chunk)
+            server.send(b'.\r\n')
+        except BaseException:
+            # Сервер ждёт окончания письма и не ответит на QUIT, закрываем соединение сразу
+            server.close()
+            self.server = None
+            raise
+        code, response = server.getreply()
+        if code != 250:
+            raise smtplib.SMTPDataError(code, response)
+        if refused:
+            logger.warning(f"Сервер не принял адреса: {refused}")
+
+
+def is_transient(error):
+    """
+    Временная ошибка: обрыв соединения, сетевая ошибка или ответ сервера 4xx.
+    Остальные ошибки SMTP, например 550 по адресу получателя, постоянные - повтор не поможет
+    """
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return all(400 <= code < 500 for code, _ in error.recipients.values())
+    if isinstance(error, smtplib.SMTPResponseException):
+        return 400 <= error.smtp_code < 500
+    if isinstance(error, smtplib.SMTPServerDisconnected):
+        return True
+    # SMTPException - подкласс OSError, поэтому сетевые ошибки отделяем от прочих ошибок SMTP
+    return isinstance(error, OSError) and not isinstance(error, smtplib.SMTPException)
+
+
+def encoded_size(size):
+    """Размер вложения в base64 со строками по 76 символов и переводами строк"""
+    return (size + 56) // 57 * 78
 
 
-def send(message=None):
+def split_files(files, max_size, directory):
+    """
+    Раскладываем вложения по письмам так, чтобы вложения письма в base64 не превышали max_size.
+    Файл больше предела делится на части архива split_file, каждая часть - в отдельном письме
+
+    :param files: list - Файлы вложений
+    :param max_size: int - Предельный размер вложений письма в байтах
+    :param directory: str - Папка для частей архива
+    :return: list - Списки файлов по письмам
+    """
+    groups, size = [[]], 0
+    for file in files:
+        file_size = encoded_size(os.path.getsize(file))
+        if file_size > max_size:
+            logger.warning(f"Файл {file} больше предельного размера письма, отправляем его частями архива")
+            groups.extend([part] for part in split_file(file, max_size, directory))
+            groups.append([])
+            size = 0
+            continue
+        if groups[-1] and size + file_size > max_size:
+            groups.append([])
+            size = 0
+        groups[-1].append(file)
+        size += file_size
+    return [group for group in groups if group]
+
+
+def split_file(file, max_size, directory):
+    """
+    Упаковываем файл в zip и делим архив на части <имя>.zip.001, .002, ... не больше max_size в base64
+
+    :param file: str - Файл вложения
+    :param max_size: int - Предельный размер вложений письма в байтах
+    :param directory: str - Папка для частей архива
+    :return: list - Пути к частям архива
+    """
+    archive = os.path.join(directory, os.path.basename(file) + '.zip')
+    with zipfile.ZipFile(archive, 'w', zipfile.ZIP_DEFLATED) as zf:
+        zf.write(file, os.path.basename(file))
+    part_size = max_size // 78 * 57
+    parts = []
+    with open(archive, 'rb') as src:
+        while True:
+            part = f"{archive}.{len(parts) + 1:03d}"
+            with open(part, 'wb') as dst:
+                written = 0
+                while written < part_size:
+                    block = src.read(min(ENCODE_BLOCK, part_size - written))
+                    if not block:
+                        break
+                    dst.write(block)
+                    written += len(block)
+            if not written:
+                os.remove(part)
+                break
+            parts.append(part)
+    os.remove(archive)
+    return parts
+
+
+def header_bytes(msg):
+    """Заголовки части письма без содержимого в виде для передачи по SMTP"""
+    msg.set_payload('')
+    return msg.as_bytes()
+
+
+def message_chunks(addr_to, subject, content, files):
+    """
+    Формируем письмо частями: заголовки, текст и вложения, которые считываются
+    и кодируются в base64 блоками по ENCODE_BLOCK байт
+
+    :return: Генератор bytes
+    """
+    boundary = f"==============={uuid.uuid4().hex}=="
+    msg = MIMEMultipart(boundary=boundary, policy=policy.SMTP)  # Создаем сообщение
+    msg['From'] = EMAIL_CONFIG['FROM']  # Адресат
+    msg['To'] = ','.join(addr_to)  # Получатель
+    msg['Subject'] = subject  # Тема сообщения
+    yield header_bytes(msg)
+
+    delimiter = f"--{boundary}\r\n".encode('ascii')
+    yield delimiter + MIMEText(content, 'html', 'utf-8', policy=policy.SMTP).as_bytes() + b'\r\n'
+
+    for file in files:
+        part = MIMEBase('application', "octet-stream", policy=policy.SMTP)
+        part['Content-Transfer-Encoding'] = 'base64'
+        part.add_header('Content-Disposition', 'attachment', filename=('utf-8', 'fr', os.path.basename(file)))
+        yield delimiter + header_bytes(part)
+        with open(file, 'rb') as fd:
+            while True:
+                block = fd.read(ENCODE_BLOCK)
+                if not block:
+                    break
+                yield base64.encodebytes(block).replace(b'\n', b'\r\n')
+        yield b'\r\n'
+    yield f"--{boundary}--\r\n".encode('ascii')
+
+
+def send(message=None, mailer=None):
     """
     Отправляем письмо
 
@@ -21,40 +280,14 @@ def send(message=None):
         'File_name': list - Наименование файла, которое будет отображаться в письме,
         'Temp_file': list - Наименование файла, которое будет добавлено к письму,
         }
+    :param mailer: Mailer - Открытое подключение. None - подключаемся только для этого письма
     :return:
     """
     if message is None:
         logger.error("No options to send email. Pass all parameters to the function: 'message'")
+    elif mailer is not None:
+        mailer.send(message)
     else:
-        addr_from = EMAIL_CONFIG['FROM']  # Отправитель
-        addr_to = message['To']  # Получатель
-        password = EMAIL_CONFIG['PSW']  # Пароль
-
-        logger.info(f"Send message to emails {addr_to}")
-
-        msg = MIMEMultipart()  # Создаем сообщение
-        msg['From'] = addr_from  # Адресат
-        msg['To'] = ','.join(addr_to)  # Получатель
-        msg['Subject'] = message['Subject']  # Тема сообщения
-
-        # Текст сообщения в формате html
-        email_content = message['email_content']
-
-        msg.attach(MIMEText(email_content, 'html'))  # Добавляем в сообщение html
-
-        # Присоединяем файл к письму
-        for i in range(len(message['Temp_file'])):
-            part = MIMEBase('application', "octet-stream")
-            part.set_payload(open(message['Temp_file'][i], "rb").read())
-            encoders.encode_base64(part)
-            part.add_header('Content-Disposition', 'attachment', filename=('utf-8', 'fr', message['Temp_file'][i]))
-            msg.attach(part)
-
-        server = smtplib.SMTP_SSL('smtp.yandex.ru', 465)  # Создаем объект SMTP
-        server.login(addr_from, password)  # Получаем доступ
-        server.send_message(msg)  # Отправляем сообщение
-        server.quit()  # Выходим
-
-        logger.info("Mail sending completed")
+        with Mailer() as mailer:
+            mailer.send(message)
     return
-
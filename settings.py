@@ -0,0 +1,25 @@
+"""
+Доступ к необязательным настройкам из config.py
+
+Обязательные параметры (LOCAL_PATH, TO_EMAILS, EMAIL_CONFIG) читаются из config напрямую.
+Необязательные разделы задаются в config.py словарями, например:
+
+CACHE = {
+    'ENABLED': True,  # Использовать кэш разобранных выгрузок
+    'PATH': '.cache/reports',  # Папка кэша
+    'MAX_SIZE_MB': 512,  # Предельный размер кэша
+}
+"""
+import config
+
+
+def get_option(section, key, default=None):
+    """
+    Получаем значение необязательного параметра из config.py
+
+    :param section: str - Наименование раздела (словаря) в config.py
+    :param key: str - Наименование параметра в разделе
+    :param default: Значение по умолчанию, если раздел или параметр не заданы
+    :return: Значение параметра
+    """
+    return getattr(config, section, {}).get(key, default)
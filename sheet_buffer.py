@@ -0,0 +1,51 @@
+"""
+Буфер ячеек листа эксель
+
+В режиме constant_memory xlsxwriter записывает строку в файл, как только начата следующая строка,
+и запись в уже пройденные строки теряется. Буфер собирает ячейки одного листа в любом порядке
+и записывает их в лист по порядку строк. В памяти держится только один лист, а не вся книга.
+
+Буфер нужен только листам месяцев, где таблицы по типам связи стоят рядом и пишутся по очереди.
+Листы полугодий и года пишутся в лист напрямую: сначала заголовки, затем строки сотрудников по порядку.
+"""
+
+
+class SheetBuffer:
+    """Лист эксель, ячейки которого записываются по порядку строк при flush"""
+
+    def __init__(self, worksheet):
+        """
+        :param worksheet: Лист xlsxwriter
+        """
+        self.worksheet = worksheet
+        self.cells = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.flush()
+
+    def __getattr__(self, name):
+        # Настройки листа (ширина колонок, фильтр, условные форматы) от порядка строк не зависят
+        return getattr(self.worksheet, name)
+
+    def write(self, *args):
+        """
+        Запоминаем значение ячейки: write(строка, колонка, значение, формат) или write('B2', значение, формат)
+        """
+        if isinstance(args[0], str):
+            from xlsxwriter.utility import xl_cell_to_rowcol
+            args = xl_cell_to_rowcol(args[0]) + args[1:]
+        row, col, value = args[:3]
+        self.cells[(row, col)] = (value, args[3] if len(args) > 3 else None)
+
+    def write_row(self, row, col, values, cell_format=None):
+        for offset, value in enumerate(values):
+            self.write(row, col + offset, value, cell_format)
+
+    def flush(self):
+        """Записываем накопленные ячейки в лист по порядку строк и колонок"""
+        for (row, col), (value, cell_format) in sorted(self.cells.items()):
+            self.worksheet.write(row, col, value, cell_format)
+        self.cells = {}
@@ -0,0 +1,130 @@
+"""
+Генератор синтетических выгрузок со связями для замеров и проверки без сетевой папки
+
+Запуск:
+    python synthetic_exports.py exports --rows 100000 --employees 60 --malformed 0.001
+"""
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+import xlsxwriter
+
+# Имена файлов выгрузок по типам связи, как в сетевой папке
+EXPORT_NAMES = {
+    'А': 'Связи Аналог (Автомат).xlsx',
+    'Н': 'Связи Новый номер (Автомат).xlsx',
+    'М': 'Связи МОС.xlsx',
+}
+
+# Колонки выгрузки. Нужны только "Код" и "Дополнительная информация", остальные для реалистичности
+HEADER = ['Код', 'Наименование', 'Артикул', 'Производитель', 'Дополнительная информация']
+
+# Варианты ошибочных записей
+MALFORMED = [
+    '{date}/{employee}',  # Не хватает полей
+    '{day}/{employee}/{source}/{added}/{group}',  # Дата без времени
+    '{date}//{source}/{added}/{group}',  # Нет ИК сотрудника
+    '{date}/{employee}/{source}/{added}/',  # Нет номера группы
+]
+
+
+def make_records(count, employees=50, start='2026-01-01', days=365, malformed=0.0, seed=0):
+    """
+    Создаём записи вида "дата/ИК/источник/добавленный/группа"
+
+    :param count: int - Количество записей
+    :param employees: int - Количество сотрудников
+    :param start: str - Первая дата записей
+    :param days: int - Разброс дат в днях от start
+    :param malformed: float - Доля ошибочных записей
+    :param seed: int - Начальное значение генератора случайных чисел
+    :return: Series со строками записей
+    """
+    rng = np.random.default_rng(seed)
+    dates = pd.Timestamp(start) + pd.to_timedelta(rng.integers(0, days * 86400, count), unit='s')
+    parts = pd.DataFrame({
+        'date': dates.strftime('%d.%m.%Y %H:%M:%S'),
+        'day': dates.strftime('%d.%m.%Y'),
+        'employee': 'ИК' + pd.Series(rng.integers(1, employees + 1, count)).astype(str).str.zfill(4),
+        'source': 'ЦБ' + pd.Series(rng.integers(1, 10 ** 6, count)).astype(str).str.zfill(8),
+        'added': 'ЦБ' + pd.Series(rng.integers(1, 10 ** 6, count)).astype(str).str.zfill(8),
+        'group': pd.Series(rng.integers(1, count + 1, count)).astype(str),
+    })
+    records = parts['date'] + '/' + parts['employee'] + '/' + parts['source'] + '/' + parts['added'] + '/' + \
+        parts['group']
+
+    bad = np.flatnonzero(rng.random(count) < malformed)
+    for i, pattern in zip(bad, rng.integers(0, len(MALFORMED), len(bad))):
+        records.iat[i] = MALFORMED[pattern].format(**parts.iloc[i].to_dict())
+    return records
+
+
+def write_export(file_name, rows, per_cell=5, seed=0, **kwargs):
+    """
+    Записываем выгрузку .xlsx: шапка отчета, строка заголовка с "Код" и строки с записями,
+    объединёнными через ";" в колонке "Дополнительная информация"
+
+    :param file_name: str - Имя файла
+    :param rows: int - Количество строк с товарами
+    :param per_cell: int - Среднее количество записей в одной ячейке
+    :param seed: int - Начальное значение генератора случайных чисел
+    :param kwargs: Параметры make_records
+    :return: int - Количество записей в выгрузке
+    """
+    rng = np.random.default_rng(seed + 1)
+    lengths = rng.poisson(per_cell, rows)
+    records = make_records(int(lengths.sum()), seed=seed, **kwargs).tolist()
+    offsets = np.concatenate([[0], np.cumsum(lengths)])
+
+    workbook = xlsxwriter.Workbook(file_name)
+    worksheet = workbook.add_worksheet('TDSheet')
+    worksheet.write(0, 0, 'Изменения связей номенклатуры')
+    worksheet.write(1, 0, 'Параметры: Период: весь период')
+    worksheet.write(2, 0, 'Отбор: Тип связи')
+    worksheet.write_row(4, 0, HEADER)
+    for row in range(rows):
+        info = ';'.join(records[offsets[row]:offsets[row + 1]]) or None
+        worksheet.write_row(row + 5, 0, [f"ЦБ{row:08d}", f"Товар {row}", f"ART-{row}", 'Производитель', info])
+    workbook.close()
+    return len(records)
+
+
+def generate_share(path, rows, **kwargs):
+    """
+    Создаём папку с выгрузками по всем типам связи
+
+    :param path: str - Папка для выгрузок
+    :param rows: int - Количество строк в каждой выгрузке
+    :param kwargs: Параметры write_export
+    :return: dict - Имя файла -> количество записей
+    """
+    os.makedirs(path, exist_ok=True)
+    seed = kwargs.pop('seed', 0)
+    result = {}
+    for i, name in enumerate(EXPORT_NAMES.values()):
+        result[name] = write_export(os.path.join(path, name), rows, seed=seed + i, **kwargs)
+    return result
+
+
+def run():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('path', help='Папка для выгрузок')
+    parser.add_argument('--rows', type=int, default=10000, help='Количество строк в каждой выгрузке')
+    parser.add_argument('--per-cell', type=int, default=5, help='Среднее количество записей в одной ячейке')
+    parser.add_argument('--employees', type=int, default=50, help='Количество сотрудников')
+    parser.add_argument('--start', default='2026-01-01', help='Первая дата записей')
+    parser.add_argument('--days', type=int, default=365, help='Разброс дат в днях')
+    parser.add_argument('--malformed', type=float, default=0.0, help='Доля ошибочных записей')
+    parser.add_argument('--seed', type=int, default=0, help='Начальное значение генератора случайных чисел')
+    args = parser.parse_args()
+
+    result = generate_share(args.path, args.rows, per_cell=args.per_cell, employees=args.employees,
+                            start=args.start, days=args.days, malformed=args.malformed, seed=args.seed)
+    for name, count in result.items():
+        print(f"{name}: {count} записей")
+
+
+if __name__ == '__main__':
+    run()
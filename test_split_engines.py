@@ -0,0 +1,113 @@
+"""
+Проверка, что движки разбора записей pandas и polars (TRANSFORM['ENGINE']) дают одинаковый результат
+и одинаковый файл карантина
+
+Запуск:
+    python -m pytest -q test_split_engines.py
+"""
+import os
+import sys
+import types
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+import pytest
+
+try:
+    import config
+except ImportError:
+    # Для проверки рабочий config.py не нужен, все параметры задаются ниже
+    config = types.ModuleType('config')
+    config.EMAIL_CONFIG = {'FROM': '', 'PSW': ''}
+    sys.modules['config'] = config
+
+import main
+import synthetic_exports
+
+pytest.importorskip('polars')
+
+RECORD = '05.03.2026 10:15:00/ИК0001/ЦБ00000001/ЦБ00000002/17'
+
+# Ячейки "Дополнительная информация" с пограничными случаями разбора
+CELLS = {
+    'ordinary': [RECORD, '06.03.2026 23:59:59/ИК0002/ЦБ1/ЦБ2/18;07.03.2026 00:00:00/ИК0003/ЦБ3/ЦБ4/19'],
+    'trailing_separator': [RECORD + ';', '06.03.2026 11:00:00/ИК0002/ЦБ1/ЦБ2/18;;'],
+    'doubled_separator': [RECORD + ';;06.03.2026 11:00:00/ИК0002/ЦБ1/ЦБ2/18', ';' + RECORD],
+    'six_fields': [RECORD + '/лишнее', '06.03.2026 11:00:00/ИК0002/ЦБ1/ЦБ2/18;' + RECORD + '/'],
+    'short_records': ['05.03.2026 10:15:00/ИК0001', '05.03.2026 10:15:00', 'текст без разделителей'],
+    'empty_fields': ['05.03.2026 10:15:00//ЦБ1/ЦБ2/17', '05.03.2026 10:15:00/ИК0001/ЦБ1/ЦБ2/',
+                     '05.03.2026 10:15:00/ИК0001///17'],
+    'wrong_date_format': ['05.03.2026/ИК0001/ЦБ1/ЦБ2/17', '5.3.2026 10:15:00/ИК0001/ЦБ1/ЦБ2/17',
+                          '05.03.2026 24:00:00/ИК0001/ЦБ1/ЦБ2/17', '2026-03-05 10:15:00/ИК0001/ЦБ1/ЦБ2/17'],
+    'duplicates': [RECORD + ';' + RECORD, RECORD, RECORD.replace('ЦБ00000001', 'ЦБ9')],
+    'non_string_cells': [RECORD, 12345, 1.5, None, np.nan, pd.Timestamp('2026-03-05'), ''],
+}
+
+# Несуществующие даты правильного формата: оба движка отправляют запись в карантин
+IMPOSSIBLE_DATES = ['31.02.2026 10:15:00/ИК0001/ЦБ1/ЦБ2/17', '05.13.2026 10:15:00/ИК0001/ЦБ1/ЦБ2/17',
+                    '00.03.2026 10:15:00/ИК0001/ЦБ1/ЦБ2/17', '29.02.2026 10:15:00/ИК0001/ЦБ1/ЦБ2/17',
+                    '29.02.1900 10:15:00/ИК0001/ЦБ1/ЦБ2/17', '01.01.0001 10:15:00/ИК0001/ЦБ1/ЦБ2/17']
+
+
+def info_frame(cells):
+    """DataFrame как после rebuild_df: индекс "Код" и колонка "Дополнительная информация\""""
+    return pd.DataFrame({'Дополнительная информация': np.array(cells, dtype=object)},
+                        index=pd.Index([f'К{i}' for i in range(len(cells))], name='Код'))
+
+
+def run_engine(engine, df, work_dir):
+    """
+    Разбираем записи движком engine
+    :return: tuple - (результат split_df, содержимое файла карантина или None)
+    """
+    quarantine = os.path.join(work_dir, engine)
+    with mock.patch.object(config, 'TRANSFORM', {'ENGINE': engine}, create=True), \
+            mock.patch.object(config, 'QUARANTINE', {'PATH': quarantine}, create=True):
+        result = main.split_df(df, 'source.xlsx')
+    file_name = os.path.join(quarantine, 'source.csv')
+    if not os.path.exists(file_name):
+        return result, None
+    with open(file_name, 'rb') as fd:
+        return result, fd.read()
+
+
+def assert_same(df, work_dir):
+    result_pandas, quarantine_pandas = run_engine('pandas', df, work_dir)
+    result_polars, quarantine_polars = run_engine('polars', df, work_dir)
+    pd.testing.assert_frame_equal(result_pandas, result_polars)
+    assert quarantine_pandas == quarantine_polars
+    return result_pandas, quarantine_pandas
+
+
+@pytest.mark.parametrize('case', list(CELLS))
+def test_edge_cases(case, tmp_path):
+    assert_same(info_frame(CELLS[case]), str(tmp_path))
+
+
+def test_all_edge_cases_together(tmp_path):
+    result, quarantine = assert_same(info_frame([cell for cells in CELLS.values() for cell in cells]), str(tmp_path))
+    assert len(result) > 0
+    assert quarantine is not None
+
+
+def test_synthetic_export(tmp_path):
+    records = synthetic_exports.make_records(20000, malformed=0.01)
+    lengths = np.random.default_rng(0).poisson(5, 4000)
+    offsets = np.concatenate([[0], np.cumsum(lengths)])
+    cells = [';'.join(records.iloc[start:end]) or None for start, end in zip(offsets[:-1], offsets[1:])]
+    assert_same(info_frame(cells), str(tmp_path))
+
+
+def test_no_records(tmp_path):
+    result, quarantine = assert_same(info_frame([None, np.nan, 7, '', ';', ';;']), str(tmp_path))
+    assert result.empty
+    assert quarantine is None
+
+
+@pytest.mark.parametrize('record', IMPOSSIBLE_DATES)
+def test_impossible_date_quarantined(record, tmp_path):
+    result, quarantine = assert_same(info_frame([RECORD, record, '29.02.2028 10:15:00/ИК0002/ЦБ1/ЦБ2/18']),
+                                     str(tmp_path))
+    assert len(result) == 2
+    assert quarantine.decode('utf-8-sig').splitlines()[1:] == [f'К1;{record};Формат даты']
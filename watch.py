@@ -0,0 +1,197 @@
+"""
+Режим службы: программа работает постоянно и держит разобранные выгрузки в памяти
+
+Запуск:
+    python watch.py --period 2026 --to TO_CORRECT
+
+Каждые WATCH['INTERVAL'] секунд проверяется список выгрузок. Заново считываются только новые
+и изменившиеся файлы (по размеру и дате изменения), после чего отчеты сразу пересобираются.
+Отчеты отправляются на почту ежедневно в WATCH['SEND_AT'] и по запросу: чтобы отправить отчеты
+вне расписания, достаточно создать файл WATCH['TRIGGER'], после отправки он удаляется.
+
+Настройки задаются в config.py в разделе WATCH:
+WATCH = {
+    'INTERVAL': 60,  # Секунд между проверками списка выгрузок
+    'SEND_AT': ['09:00'],  # Время ежедневной отправки отчетов
+    'TRIGGER': 'send_reports.now',  # Файл-запрос на отправку отчетов
+}
+"""
+import argparse
+import os
+import time
+from datetime import datetime, timedelta
+
+from loguru import logger
+
+import main
+import metrics
+import report_periods
+import report_source
+from settings import get_option
+
+
+class Watcher:
+    """Разобранные выгрузки и сформированные отчеты между проверками"""
+
+    def __init__(self, periods=None, to=('TO_CORRECT',)):
+        """
+        :param periods: list - ReportPeriod. None - ежемесячный отчет по дате отчета на момент проверки
+        :param to: list - Наборы получателей из config.TO_EMAILS
+        """
+        self.periods = periods
+        self.addresses = main.recipients(to)
+        self.date_range = None
+        self.signatures = {}  # Имя файла -> (размер, дата изменения) считанной версии
+        self.frames = {}  # Имя файла -> DataFrame за период отчетов
+        self.df_dict = None
+        self.files = []
+        self.measured = False  # Идут замеры metrics: проверка пересобирает или отправляет отчеты
+
+    def current_periods(self):
+        return self.periods or [main.report_period()]
+
+    def start_run(self):
+        """Начинаем замеры, когда проверка выгрузок действительно пересобирает или отправляет отчеты"""
+        if not self.measured:
+            metrics.start_run()
+            self.measured = True
+
+    def finish_run(self):
+        """Завершаем замеры проверки, если они начинались"""
+        if self.measured:
+            self.measured = False
+            metrics.finish_run()
+
+    def refresh(self, rebuild=False):
+        """
+        Проверяем выгрузки и считываем заново только новые и изменившиеся файлы
+
+        :param rebuild: bool - Пересобрать хранилище связей полностью, если оно включено
+        :return: bool - Данные изменились, отчеты нужно пересобрать
+        """
+        date_range = report_periods.periods_range(self.current_periods())
+        if date_range != self.date_range:
+            # Сменился период отчетов, например наступил новый месяц: все файлы считываются заново
+            self.date_range, self.signatures, self.frames = date_range, {}, {}
+
+        source = report_source.get_source()
+        try:
+            list_file = [item for item in source.listdir() if item.endswith('.xlsx')]
+            signatures = {item: signature(source.stat(item)) for item in list_file}
+        except (ConnectionError, OSError) as error:
+            # Без списка файлов данные не трогаем, чтобы не потерять выгрузки из-за сбоя сети
+            logger.error(f"Не могу проверить выгрузки: {error}")
+            main.connect_share()
+            return False
+
+        removed = set(self.frames) - set(signatures)
+        changed = [item for item in list_file if self.signatures.get(item) != signatures[item]]
+        if not (rebuild or removed or changed or self.df_dict is None):
+            return False
+        self.start_run()
+
+        updated = rebuild
+        for item in removed:
+            logger.info(f"Выгрузка {item} удалена из папки с отчетами")
+            del self.frames[item], self.signatures[item]
+            updated = True
+
+        if changed:
+            logger.info(f"Считываем новые и изменившиеся выгрузки: {changed}")
+            for item, df_cross in zip(changed, main.process_reports(changed, date_range)):
+                # Непрочитанный файл попробуем считать при следующей проверке, пока остаются прежние данные
+                if df_cross is not None:
+                    self.frames[item], self.signatures[item] = df_cross, signatures[item]
+                    updated = True
+
+        if updated or self.df_dict is None:
+            list_file = [item for item in list_file if item in self.frames]
+            self.df_dict = main.combine_reports(list_file, [self.frames[item] for item in list_file],
+                                                rebuild, date_range)
+            return True
+        return False
+
+    def write_reports(self):
+        """Пересобираем отчеты из данных в памяти"""
+        self.files = main.reports_to_excel(self.df_dict, self.current_periods())
+        logger.info(f"Отчеты обновлены: {self.files}")
+
+    def send_reports(self):
+        main.send_reports(self.files, self.addresses)
+
+
+def signature(stat):
+    """Признак версии файла: размер и дата изменения"""
+    return stat.st_size, stat.st_mtime
+
+
+def next_send_time(now, send_at):
+    """
+    Ближайшее время отправки отчетов после now
+    :param now: datetime
+    :param send_at: list - Время отправки в виде 'ЧЧ:ММ'
+    :return: datetime или None, если отправка только по запросу
+    """
+    times = []
+    for text in send_at:
+        at = datetime.strptime(text, '%H:%M')
+        moment = now.replace(hour=at.hour, minute=at.minute, second=0, microsecond=0)
+        times.append(moment if moment > now else moment + timedelta(days=1))
+    return min(times, default=None)
+
+
+def serve(periods=None, to=('TO_CORRECT',), send=True, rebuild=False):
+    """
+    Работаем в режиме службы: проверяем выгрузки, пересобираем и отправляем отчеты
+
+    :param periods: list - ReportPeriod. None - ежемесячный отчет по дате отчета
+    :param to: list - Наборы получателей из config.TO_EMAILS
+    :param send: bool - Отправлять отчеты на почту
+    :param rebuild: bool - Пересобрать хранилище связей полностью при первой проверке
+    """
+    interval = get_option('WATCH', 'INTERVAL', 60)
+    send_at = get_option('WATCH', 'SEND_AT', ['09:00'])
+    trigger = get_option('WATCH', 'TRIGGER', 'send_reports.now')
+    watcher = Watcher(periods, to)
+    main.connect_share()
+    next_send = next_send_time(datetime.now(), send_at)
+    logger.info(f"Режим службы: проверка выгрузок каждые {interval} с, отправка отчетов {next_send}")
+
+    while True:
+        try:
+            updated = watcher.refresh(rebuild)
+            rebuild = False
+            if updated:
+                watcher.write_reports()
+
+            requested = os.path.exists(trigger)
+            if (requested or next_send is not None and datetime.now() >= next_send) and watcher.files:
+                if send:
+                    watcher.start_run()
+                    watcher.send_reports()
+                if requested:
+                    os.remove(trigger)
+                next_send = next_send_time(datetime.now(), send_at)
+        except Exception:
+            # Служба продолжает работу, следующая проверка начнётся по расписанию
+            logger.exception("Ошибка при обновлении отчетов")
+        finally:
+            watcher.finish_run()
+        time.sleep(interval)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Отчет по созданию связей кроссов в режиме службы',
+                                     epilog=__doc__ + report_periods.__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rebuild', action='store_true', help='Пересобрать хранилище связей полностью при запуске')
+    parser.add_argument('--period', nargs='+', default=[],
+                        help='Периоды отчетов, по умолчанию - месяц даты отчета. Форматы ниже')
+    parser.add_argument('--to', nargs='+', default=['TO_CORRECT'], help='Наборы получателей из TO_EMAILS')
+    parser.add_argument('--no-mail', action='store_true', help='Не отправлять отчеты на почту')
+    args = parser.parse_args()
+    try:
+        report_list = report_periods.parse_periods(args.period)
+    except ValueError as error:
+        parser.error(str(error))
+    serve(periods=report_list or None, to=args.to, send=not args.no_mail, rebuild=args.rebuild)
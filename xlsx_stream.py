@@ -0,0 +1,170 @@
+"""
+Потоковое чтение первого листа .xlsx без построения всей таблицы в памяти
+
+Лист разбирается как XML по мере чтения, значения декодируются только в нужных колонках.
+Ячейки с общими строками (sharedStrings.xml) отдаются номерами SharedString, текст подставляет
+resolve одним проходом по таблице общих строк: декодируются только строки, на которые ссылаются
+считанные ячейки, строки остальных колонок в память не попадают. Форматы, формулы и стили не читаются.
+"""
+import posixpath
+import re
+import zipfile
+import xml.etree.ElementTree as ET
+
+NS_MAIN = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+NS_REL = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}'
+NS_PKG_REL = '{http://schemas.openxmlformats.org/package/2006/relationships}'
+
+TAG_ROW = NS_MAIN + 'row'
+TAG_VALUE = NS_MAIN + 'v'
+TAG_TEXT = NS_MAIN + 't'
+TAG_RUN = NS_MAIN + 'r'
+TAG_SI = NS_MAIN + 'si'
+TAG_INLINE = NS_MAIN + 'is'
+
+CELL_REF = re.compile(r'([A-Z]+)')
+
+
+class SharedString(int):
+    """Номер строки в таблице общих строк. Текст подставляется в XlsxSheet.resolve"""
+
+
+class XlsxSheet:
+    """Первый лист книги .xlsx для потокового чтения строк"""
+
+    def __init__(self, file_obj):
+        """
+        :param file_obj: Путь к файлу или файловый объект .xlsx
+        """
+        self.archive = zipfile.ZipFile(file_obj)
+        self.sheet_path = self._first_sheet_path()
+
+    def close(self):
+        self.archive.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _first_sheet_path(self):
+        """Определяем путь к первому листу книги по workbook.xml и его связям"""
+        workbook = ET.parse(self.archive.open('xl/workbook.xml')).getroot()
+        sheet = workbook.find(f'{NS_MAIN}sheets/{NS_MAIN}sheet')
+        rel_id = sheet.get(NS_REL + 'id')
+        rels = ET.parse(self.archive.open('xl/_rels/workbook.xml.rels')).getroot()
+        for rel in rels.iter(NS_PKG_REL + 'Relationship'):
+            if rel.get('Id') == rel_id:
+                target = rel.get('Target')
+                if target.startswith('/'):
+                    return target[1:]
+                return posixpath.normpath(posixpath.join('xl', target))
+        raise ValueError(f"Не нашли лист {rel_id} в книге")
+
+    def shared_strings(self, indices):
+        """
+        Считываем из таблицы общих строк только строки с нужными номерами за один проход
+
+        :param indices: set - Номера строк
+        :return: dict - Номер -> текст
+        """
+        strings = {}
+        if not indices or 'xl/sharedStrings.xml' not in self.archive.namelist():
+            return strings
+        last = max(indices)
+        index = 0
+        with self.archive.open('xl/sharedStrings.xml') as fd:
+            for _, element in ET.iterparse(fd):
+                if element.tag != TAG_SI:
+                    continue
+                if index in indices:
+                    strings[index] = string_item_text(element)
+                element.clear()
+                index += 1
+                if index > last:
+                    break
+        return strings
+
+    def resolve(self, *columns):
+        """
+        Подставляем текст общих строк вместо номеров SharedString за один проход по таблице общих строк
+
+        :param columns: list - Списки значений ячеек из iter_rows, изменяются на месте
+        :return: Первый из списков
+        """
+        strings = self.shared_strings({value for values in columns for value in values
+                                       if isinstance(value, SharedString)})
+        for values in columns:
+            for i, value in enumerate(values):
+                if isinstance(value, SharedString):
+                    values[i] = strings.get(value)
+        return columns[0]
+
+    def iter_rows(self, columns=None, min_row=1, max_row=None):
+        """
+        Считываем строки листа
+
+        :param columns: set - Номера колонок (с 0), значения которых нужны. None - все колонки
+        :param min_row: int - Первая строка (с 1)
+        :param max_row: int - Последняя строка (с 1) или None - до конца листа
+        :return: Генератор кортежей (номер строки, dict номер колонки -> значение).
+                 Вместо текста общих строк - номера SharedString, см. resolve
+        """
+        row_number = 0
+        with self.archive.open(self.sheet_path) as fd:
+            for _, element in ET.iterparse(fd):
+                if element.tag != TAG_ROW:
+                    continue
+                row_number = int(element.get('r', row_number + 1))
+                if max_row is not None and row_number > max_row:
+                    break
+                if row_number >= min_row:
+                    yield row_number, self._row_values(element, columns)
+                element.clear()
+
+    def _row_values(self, row, columns):
+        """Декодируем значения ячеек строки в нужных колонках"""
+        values = {}
+        col = -1
+        for cell in row:
+            ref = cell.get('r')
+            col = column_index(ref) if ref else col + 1
+            if columns is None or col in columns:
+                values[col] = self._cell_value(cell)
+        return values
+
+    def _cell_value(self, cell):
+        """Получаем значение ячейки по её типу"""
+        cell_type = cell.get('t', 'n')
+        if cell_type == 'inlineStr':
+            inline = cell.find(TAG_INLINE)
+            return None if inline is None else string_item_text(inline)
+        value = cell.findtext(TAG_VALUE)
+        if value is None:
+            return None
+        if cell_type == 's':
+            return SharedString(value)
+        if cell_type == 'n':
+            return float(value) if '.' in value or 'E' in value or 'e' in value else int(value)
+        if cell_type == 'b':
+            return value == '1'
+        return value
+
+
+def string_item_text(element):
+    """Собираем текст строки из элемента <si> или <is>, без фонетических подсказок"""
+    text = element.find(TAG_TEXT)
+    if text is not None:
+        return text.text or ''
+    return ''.join(run.findtext(TAG_TEXT, '') for run in element.iter(TAG_RUN))
+
+
+def column_index(ref):
+    """
+    Получаем номер колонки (с 0) из ссылки на ячейку, например 'C12' -> 2
+    """
+    index = 0
+    for char in CELL_REF.match(ref).group(1):
+        index = index * 26 + ord(char) - ord('A') + 1
+    return index - 1